@@ -0,0 +1,208 @@
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import numpy as np
+
+from ex1 import EnvMap, EngineType, LocationShape, DistributionRule, P, L, PERSONS_DISTRIBUTION, \
+    all_around_policy, four_directions_policy, wrap_all_around_policy
+
+# throughput benchmarks of the simulation core: init time, turns per second and peak memory of EnvMap
+# across grid sizes, densities, location shapes, distribution rules, policies and engines.
+#   python benchmark.py run --preset full --output results.json
+#   python benchmark.py compare baseline.json results.json
+
+POLICIES = {policy.__name__: policy for policy in (wrap_all_around_policy, all_around_policy, four_directions_policy)}
+PRESETS = {
+    "quick": {"sizes": (100, 200), "max_objects_size": 200},
+    "full": {"sizes": (100, 500, 1000, 2000, 4000), "max_objects_size": 1000},
+}
+DENSITIES = (0.3, 0.6, P)
+# every axis but one is kept at its base value, so each axis is measured on its own
+BASE_CASE = {
+    "size": 200,
+    "density": P,
+    "shape": LocationShape.Random.name,
+    "rule": DistributionRule.Random.name,
+    "policy": wrap_all_around_policy.__name__,
+}
+DEFAULT_N_TURNS = 50
+DEFAULT_REPEAT = 3
+DEFAULT_SEED = 0
+DEFAULT_THRESHOLD = 0.1
+# the measured values, and whether higher is better
+METRICS = {"init_seconds": False, "turns_per_second": True, "peak_memory_bytes": False}
+
+
+def case_name(case: Dict) -> str:
+    return (f"{case['engine']}-{case['size']}x{case['size']}-p{case['density']}-{case['shape']}-{case['rule']}"
+            f"-{case['policy']}")
+
+
+def benchmark_cases(sizes, max_objects_size: int, engines: List[str]) -> List[Dict]:
+    cases = []
+    variations = [{"size": size} for size in sizes]
+    variations += [{"density": density} for density in DENSITIES]
+    variations += [{"shape": shape.name} for shape in LocationShape]
+    variations += [{"rule": rule.name} for rule in DistributionRule]
+    variations += [{"policy": policy} for policy in POLICIES]
+    for variation in variations:
+        for engine in engines:
+            case = dict(BASE_CASE, **variation, engine=engine)
+            if engine == EngineType.Objects.name and case["size"] > max_objects_size:
+                continue
+            if case not in cases:
+                cases.append(case)
+    return cases
+
+
+def _density(case: Dict) -> float:
+    if case["shape"] != LocationShape.Square.name:
+        return case["density"]
+    # the square shape needs a perfect square number of persons
+    root = int(case["size"] * math.sqrt(case["density"]))
+    return root ** 2 / case["size"] ** 2
+
+
+def _create_env_map(case: Dict, seed: int) -> EnvMap:
+    return EnvMap(
+        n_rows=case["size"],
+        n_cols=case["size"],
+        population_density=_density(case),
+        persons_distribution=PERSONS_DISTRIBUTION,
+        policy=POLICIES[case["policy"]],
+        cool_down_l=L,
+        location_shape=LocationShape[case["shape"]],
+        distribution_rule=DistributionRule[case["rule"]],
+        engine_type=EngineType[case["engine"]],
+        rng=seed,
+    )
+
+
+def _run_case_once(case: Dict, n_turns: int, seed: int):
+    start = time.perf_counter()
+    env_map = _create_env_map(case, seed=seed)
+    init_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(n_turns):
+        env_map.spread_rumor()
+    run_seconds = time.perf_counter() - start
+    return init_seconds, run_seconds
+
+
+def run_case(case: Dict, n_turns: int, repeat: int, seed: int) -> Dict:
+    # best of `repeat` timings, then one more pass under tracemalloc for the peak memory
+    # (tracing slows the run down, so it is kept out of the timings)
+    timings = [_run_case_once(case, n_turns=n_turns, seed=seed) for _ in range(repeat)]
+    tracemalloc.start()
+    _run_case_once(case, n_turns=n_turns, seed=seed)
+    _, peak_memory_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(
+        case,
+        name=case_name(case),
+        init_seconds=min(init_seconds for init_seconds, _ in timings),
+        turns_per_second=n_turns / min(run_seconds for _, run_seconds in timings),
+        peak_memory_bytes=peak_memory_bytes,
+    )
+
+
+def run_benchmarks(cases: List[Dict], n_turns: int, repeat: int, seed: int) -> Dict:
+    results = []
+    for i, case in enumerate(cases):
+        result = run_case(case, n_turns=n_turns, repeat=repeat, seed=seed)
+        print(f"[{i + 1}/{len(cases)}] {result['name']}: init {result['init_seconds']:.3f}s, "
+              f"{result['turns_per_second']:.1f} turns/s, peak {result['peak_memory_bytes'] / 2 ** 20:.1f} MB")
+        results.append(result)
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "n_turns": n_turns,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    # the regressions of current against baseline, a metric regresses when it is worse by more than threshold
+    # (a fraction of the baseline value). cases that are only in one of them are skipped
+    baseline_results = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        baseline_result = baseline_results.get(result["name"])
+        if baseline_result is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            change = (result[metric] - baseline_result[metric]) / baseline_result[metric]
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(
+                    f"{result['name']} {metric}: {baseline_result[metric]:.4g} -> {result[metric]:.4g} "
+                    f"({change:+.1%})"
+                )
+    return regressions
+
+
+def _report_regressions(regressions: List[str]) -> int:
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regressions")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="EnvMap throughput benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--preset", choices=list(PRESETS), default="quick")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=None, help="overrides the preset's sizes")
+    run_parser.add_argument("--engines", nargs="+", choices=[engine.name for engine in EngineType],
+                            default=[engine.name for engine in EngineType])
+    run_parser.add_argument("--turns", type=int, default=DEFAULT_N_TURNS)
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--baseline", default=None, help="compare the results against this results file")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compare_parser = subparsers.add_parser("compare", help="flag the regressions of results against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.results) as f:
+            results = json.load(f)
+        return _report_regressions(compare(baseline, results, threshold=args.threshold))
+
+    preset = PRESETS[args.preset]
+    cases = benchmark_cases(
+        sizes=args.sizes if args.sizes is not None else preset["sizes"],
+        max_objects_size=preset["max_objects_size"],
+        engines=args.engines,
+    )
+    results = run_benchmarks(cases, n_turns=args.turns, repeat=args.repeat, seed=args.seed)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"wrote {len(results['results'])} results to {args.output}")
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    return _report_regressions(compare(baseline, results, threshold=args.threshold))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
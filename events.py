@@ -0,0 +1,126 @@
+import logging
+import sys
+import time
+from typing import Callable, Dict, List
+
+# the events of an EnvMap and the arguments their callbacks get:
+#   on_first_spreader(env_map, location) - the first spreader was picked, while the map is created
+#   on_turn_end(env_map)                 - after every spread_rumor
+#   on_quiescent(env_map)                - once, after the turn the map stopped changing at
+FIRST_SPREADER = "on_first_spreader"
+TURN_END = "on_turn_end"
+QUIESCENT = "on_quiescent"
+EVENTS = (FIRST_SPREADER, TURN_END, QUIESCENT)
+
+logger = logging.getLogger(__name__)
+
+
+class EventBus:
+    """
+    The subscribers of an EnvMap's events. A sink is any object with on_* methods named after EVENTS,
+    add_sink subscribes the ones it has. An event nobody subscribed to is not formatted and writes nothing
+    """
+
+    def __init__(self, *sinks):
+        self._subscribers: Dict[str, List[Callable]] = {event: [] for event in EVENTS}
+        for sink in sinks:
+            self.add_sink(sink)
+
+    def subscribe(self, event: str, callback: Callable) -> None:
+        if event not in self._subscribers:
+            raise Exception(f"Unknown event {event}, it should be one of {EVENTS}")
+        self._subscribers[event].append(callback)
+
+    def unsubscribe(self, event: str, callback: Callable) -> None:
+        self._subscribers[event].remove(callback)
+
+    def add_sink(self, sink) -> None:
+        for event in EVENTS:
+            callback = getattr(sink, event, None)
+            if callback is not None:
+                self.subscribe(event, callback)
+
+    def remove_sink(self, sink) -> None:
+        for event in EVENTS:
+            callback = getattr(sink, event, None)
+            if callback is not None:
+                self.unsubscribe(event, callback)
+
+    def has_subscribers(self, event: str) -> bool:
+        return bool(self._subscribers[event])
+
+    def emit(self, event: str, env_map, *args) -> None:
+        for callback in self._subscribers[event]:
+            callback(env_map, *args)
+
+
+class LoggingSink:
+    """
+    Logs the events to a logger, the turns only every every_n_turns turns
+    """
+
+    def __init__(self, logger: logging.Logger = logger, level: int = logging.INFO, every_n_turns: int = 1):
+        self.logger = logger
+        self.level = level
+        self.every_n_turns = every_n_turns
+
+    def on_first_spreader(self, env_map, location) -> None:
+        self.logger.log(self.level, "first spreader:%s", location)
+
+    def on_turn_end(self, env_map) -> None:
+        if env_map.turn % self.every_n_turns != 0 or not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(self.level, "turn %d: believers %.4f", env_map.turn, env_map.calculate_percentage_of_believers())
+
+    def on_quiescent(self, env_map) -> None:
+        self.logger.log(
+            self.level, "quiescent after turn %d: believers %.4f", env_map.turn,
+            env_map.calculate_percentage_of_believers()
+        )
+
+
+class ProgressSink:
+    """
+    A one line progress bar of a run of n_turns turns, redrawn at most every min_interval_seconds
+    """
+
+    def __init__(self, n_turns: int, stream=None, width: int = 40, min_interval_seconds: float = 0.1):
+        self.n_turns = n_turns
+        self.stream = stream if stream is not None else sys.stderr
+        self.width = width
+        self.min_interval_seconds = min_interval_seconds
+        self._last_draw_time = None
+
+    def _draw(self, env_map, end: str = "") -> None:
+        done = min(env_map.turn, self.n_turns)
+        filled = self.width * done // max(self.n_turns, 1)
+        self.stream.write(
+            f"\r[{'#' * filled}{'.' * (self.width - filled)}] {done}/{self.n_turns} "
+            f"believers {env_map.calculate_percentage_of_believers():.1%}{end}"
+        )
+        self.stream.flush()
+
+    def on_turn_end(self, env_map) -> None:
+        now = time.perf_counter()
+        if env_map.turn < self.n_turns and self._last_draw_time is not None \
+                and now - self._last_draw_time < self.min_interval_seconds:
+            return
+        self._last_draw_time = now
+        self._draw(env_map, end="\n" if env_map.turn == self.n_turns else "")
+
+    def on_quiescent(self, env_map) -> None:
+        if env_map.turn < self.n_turns:
+            self._draw(env_map, end=" (quiescent)\n")
+
+
+class MetricsSink:
+    """
+    Writes every turn's metrics of a map as a row of a metrics_writer.MetricsWriter
+    """
+
+    def __init__(self, metrics_writer, replica: int = 0):
+        self.metrics_writer = metrics_writer
+        self.replica = replica
+
+    def on_turn_end(self, env_map) -> None:
+        self.metrics_writer.write_env_map(self.replica, env_map.turn, env_map)
@@ -1,14 +1,26 @@
-import random
-from collections import Counter
+import functools
+import inspect
+import logging
 from enum import Enum
-from typing import Dict, Tuple, List, Callable
+from typing import Dict, Tuple, List, Callable, Set
 import typing
 
+import numpy as np
+
 from DoubtLevel import DoubtLevel
-from persons_location_generator import PersonsLocationGenerator
+from events import EventBus, FIRST_SPREADER, TURN_END, QUIESCENT, LoggingSink
+from neighbor_index import NeighborIndex
+from persons_location_generator import PersonsLocationGenerator, indices_to_locations, flat_indices_dtype
+from phase_stats import PhaseStats
+from snapshot import read_snapshot, write_snapshot
+import spread_stats
+from vectorized_engine import VectorizedEngine, EMPTY_DOUBT_LEVEL, HEARD_RUMOUR_SOMETIME, HEARD_RUMOUR_LAST_TURN, \
+    IN_COOLDOWN, MAX_COOL_DOWN_L, NEVER_HEARD, GRID_ARRAYS
 
 Location = typing.NamedTuple("Location", [("x", int), ("y", int)])
 
+logger = logging.getLogger(__name__)
+
 MATRIX_SIZE = 100
 
 P = 0.81  # population density
@@ -29,6 +41,16 @@ class DistributionRule(Enum):
     Line_Space = 4
 
 
+class EngineType(Enum):
+    Objects = 1
+    Vectorized = 2
+
+
+class StorageType(Enum):
+    Dense = 1
+    Sparse = 2
+
+
 class CellStates(Enum):
     S1 = DoubtLevel.S1
     S2 = DoubtLevel.S2
@@ -52,6 +74,20 @@ PROBABILITY_TO_BELIEVE = {
 }
 
 
+class RumourCounters:
+    """
+    Running counts of the persons in a map, updated by the person cells on every state change
+    so the metrics are answered without scanning the map
+    """
+
+    def __init__(self):
+        self.n_heard_rumour_sometime = 0
+        self.n_heard_rumour_sometime_per_doubt_level = {doubt_level: 0 for doubt_level in DoubtLevel}
+        # persons who heard the rumour last turn - the spreaders of the coming turn
+        self.n_heard_rumour_last_turn = 0
+        self.n_in_cooldown = 0
+
+
 class Cell:
     """
     This class represents a cell in the map
@@ -67,7 +103,8 @@ class Cell:
     def set_heard_rumour_last_turn(self, heard_rumour_last_turn: bool = True):
         raise NotImplementedError()
 
-    def should_believe_to_rumour(self, n_heard_rumour) -> bool:
+    def should_believe_to_rumour(self, n_heard_rumour, draw: float) -> bool:
+        # draw is a uniform [0, 1) random number, drawn by the map for all the listeners of a turn at once
         raise NotImplementedError()
 
     def toggle_heard_rumour_sometime(self):
@@ -91,8 +128,10 @@ class PersonCell(Cell):
             self,
             state,
             position,
-            cool_down_episode_countdown):
+            cool_down_episode_countdown,
+            counters: RumourCounters = None):
         super().__init__(state=state.value, position=position)
+        self._counters = counters if counters is not None else RumourCounters()
         self._probability_to_believe = PROBABILITY_TO_BELIEVE[state]
         self._doubt_level = state
         self._heard_rumour_sometime = False
@@ -112,6 +151,8 @@ class PersonCell(Cell):
         self._n_cool_down_episodes_countdown = self._cool_down_episode_countdown
 
     def set_is_in_cooldown(self, val):
+        if val != self._is_in_cooldown:
+            self._counters.n_in_cooldown += 1 if val else -1
         self._is_in_cooldown = val
 
     def set_n_cool_down_episode_countdown(self, n):
@@ -124,13 +165,30 @@ class PersonCell(Cell):
     def did_hear_rumour_sometime(self):
         return self._heard_rumour_sometime
 
+    def did_hear_rumour_last_turn(self):
+        return self._heard_rumour_last_turn
+
+    def get_doubt_level(self) -> DoubtLevel:
+        return self._doubt_level
+
+    def get_n_cool_down_episodes_countdown(self) -> int:
+        return self._n_cool_down_episodes_countdown
+
+    def is_in_cooldown(self):
+        return self._is_in_cooldown
+
     def toggle_heard_rumour_sometime(self):
+        if not self._heard_rumour_sometime:
+            self._counters.n_heard_rumour_sometime += 1
+            self._counters.n_heard_rumour_sometime_per_doubt_level[self._doubt_level] += 1
         self._heard_rumour_sometime = True
 
     def set_heard_rumour_last_turn(self, heard_rumour_last_turn: bool = True):
+        if heard_rumour_last_turn != self._heard_rumour_last_turn:
+            self._counters.n_heard_rumour_last_turn += 1 if heard_rumour_last_turn else -1
         self._heard_rumour_last_turn = heard_rumour_last_turn
 
-    def should_believe_to_rumour(self, n_heard_rumour):
+    def should_believe_to_rumour(self, n_heard_rumour, draw: float):
         if self._is_in_cooldown is True:
             return False
         prob_to_believe = self._probability_to_believe
@@ -138,7 +196,7 @@ class PersonCell(Cell):
         if n_heard_rumour >= 2:
             temporal_doubt_level = DoubtLevel(max(self._doubt_level.value - 1, MIN_DOUBT_LEVEL))
             prob_to_believe = PROBABILITY_TO_BELIEVE[temporal_doubt_level]
-        return random.random() < prob_to_believe
+        return draw < prob_to_believe
 
     def next_turn(self):
         if self._heard_rumour_last_turn or self._is_in_cooldown:
@@ -163,24 +221,138 @@ class EmptyCell(Cell):
         super().__init__(state=CellStates.EMPTY.value, position=position)
 
     def set_heard_rumour_last_turn(self, heard_rumour_last_turn: bool = True):
-        print("Set heard rumour in EmptyCell - something is wrong")
-        pass
+        logger.warning("Set heard rumour in EmptyCell - something is wrong")
 
     def was_told_rumour(self):
-        print("Empty Cell was told rumour")
-        pass
+        logger.warning("Empty Cell was told rumour")
 
     def next_turn(self):
-        print("Empty Cell next turn")
-        pass
+        logger.warning("Empty Cell next turn")
 
     def can_spread_rumour(self):
         return False
 
-    def should_believe_to_rumour(self, n_heard_rumour) -> bool:
+    def should_believe_to_rumour(self, n_heard_rumour, draw: float) -> bool:
         return False
 
 
+class PersonCellView(PersonCell):
+    """
+    PersonCell API over one square of a VectorizedEngine, the state lives in the engine's compact arrays
+    """
+
+    def __init__(self, engine: VectorizedEngine, position):
+        Cell.__init__(self, state=int(engine.doubt[tuple(position)]), position=position)
+        self._engine = engine
+        self._doubt_level = DoubtLevel(self._state)
+        self._probability_to_believe = PROBABILITY_TO_BELIEVE[self._doubt_level]
+        self._cool_down_episode_countdown = engine.cool_down_l
+
+    @property
+    def _heard_rumour_sometime(self):
+        return self._engine.get_flag(self._position, HEARD_RUMOUR_SOMETIME)
+
+    @property
+    def _heard_rumour_last_turn(self):
+        return self._engine.get_flag(self._position, HEARD_RUMOUR_LAST_TURN)
+
+    @property
+    def _is_in_cooldown(self):
+        return self._engine.get_flag(self._position, IN_COOLDOWN)
+
+    @property
+    def _n_cool_down_episodes_countdown(self):
+        return int(self._engine.countdown[self._position])
+
+    def reset_n_cool_down_episodes_countdown(self):
+        self.set_n_cool_down_episode_countdown(self._cool_down_episode_countdown)
+
+    def set_is_in_cooldown(self, val):
+        self._engine.set_flag(self._position, IN_COOLDOWN, val)
+
+    def set_n_cool_down_episode_countdown(self, n):
+        self._engine.countdown[self._position] = n
+
+    def dec_n_cool_down_episode_countdown(self):
+        if self._n_cool_down_episodes_countdown > 0:
+            self.set_n_cool_down_episode_countdown(self._n_cool_down_episodes_countdown - 1)
+
+    def toggle_heard_rumour_sometime(self):
+        self._engine.set_flag(self._position, HEARD_RUMOUR_SOMETIME, True)
+
+    def set_heard_rumour_last_turn(self, heard_rumour_last_turn: bool = True):
+        self._engine.set_flag(self._position, HEARD_RUMOUR_LAST_TURN, heard_rumour_last_turn)
+
+
+class CellGridView:
+    """
+    The List[List[Cell]] interface over a VectorizedEngine, the cells are created on access
+    """
+
+    def __init__(self, engine: VectorizedEngine):
+        self._engine = engine
+        self.n_rows, self.n_cols = engine.doubt.shape
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, x: int):
+        return CellRowView(self, x)
+
+    def get_cell(self, x: int, y: int) -> Cell:
+        position = Location(x=x, y=y)
+        if self._engine.doubt[position] == EMPTY_DOUBT_LEVEL:
+            return EmptyCell(position=position)
+        return PersonCellView(self._engine, position)
+
+
+class SparseCellGrid:
+    """
+    The List[List[Cell]] interface storing only the person cells, keyed by flat index.
+    Empty squares are not stored, an EmptyCell is created when one is accessed
+    """
+
+    def __init__(self, n_rows: int, n_cols: int):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self._cells: Dict[int, Cell] = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, x: int):
+        return CellRowView(self, x)
+
+    def _flat_index(self, x: int, y: int) -> int:
+        if not (0 <= x < self.n_rows and 0 <= y < self.n_cols):
+            raise IndexError(f"Location {(x, y)} is outside of the {self.n_rows}x{self.n_cols} map")
+        return x * self.n_cols + y
+
+    def get_cell(self, x: int, y: int) -> Cell:
+        cell = self._cells.get(self._flat_index(x, y))
+        if cell is None:
+            return EmptyCell(position=Location(x=x, y=y))
+        return cell
+
+    def set_cell(self, x: int, y: int, cell: Cell) -> None:
+        self._cells[self._flat_index(x, y)] = cell
+
+
+class CellRowView:
+    def __init__(self, grid, x: int):
+        self._grid = grid
+        self._x = x
+
+    def __len__(self):
+        return self._grid.n_cols
+
+    def __getitem__(self, y: int) -> Cell:
+        return self._grid.get_cell(self._x, y)
+
+    def __setitem__(self, y: int, cell: Cell) -> None:
+        self._grid.set_cell(self._x, y, cell)
+
+
 class EnvMap:
     def __init__(
             self,
@@ -192,12 +364,84 @@ class EnvMap:
             cool_down_l: int,
             location_shape: LocationShape,
             distribution_rule: DistributionRule,
-            location_generator=PersonsLocationGenerator()
+            location_generator=PersonsLocationGenerator(),
+            engine_type: EngineType = EngineType.Objects,
+            storage_type: StorageType = StorageType.Dense,
+            rng=None,
+            events: EventBus = None,
+            track_first_heard_turn: bool = False
     ):
+        # policy(location, n_rows, n_cols) yields the neighbors of a location on an n_rows x n_cols map, the map
+        # passes its own dimensions as keywords (a policy(location) without them is called with the location only).
+        # rng is a numpy Generator, or a seed / SeedSequence to create one from, all the randomness of the map
+        # (locations, doubt levels, first spreader and every turn) is drawn from it. None seeds from the OS.
+        # events gets the map's events from the start (the first spreader is picked while the map is created),
+        # without it the map has an EventBus with no subscribers.
+        # track_first_heard_turn keeps the vectorized engine's int32 first heard turn grid (4 more bytes per square,
+        # see first_heard_turn_grid), the objects engine always keeps it per person
+        self._init_attributes(
+            n_rows=n_rows,
+            n_cols=n_cols,
+            population_density=population_density,
+            persons_distribution=persons_distribution,
+            policy=policy,
+            cool_down_l=cool_down_l,
+            location_generator=location_generator,
+            engine_type=engine_type,
+            storage_type=storage_type,
+            rng=rng,
+            events=events,
+            track_first_heard_turn=track_first_heard_turn,
+        )
+        self.init_matrix(location_shape=location_shape, distribution_rule=distribution_rule)
+
+    def _init_attributes(
+            self,
+            n_rows: int,
+            n_cols: int,
+            population_density: float,
+            persons_distribution: Dict[DoubtLevel, float],
+            policy: Callable,
+            cool_down_l: int,
+            location_generator,
+            engine_type: EngineType,
+            storage_type: StorageType,
+            rng=None,
+            events: EventBus = None,
+            track_first_heard_turn: bool = False
+    ):
+        self.rng: np.random.Generator = np.random.default_rng(rng)
+        self.events = events if events is not None else EventBus()
+        self._reported_quiescent = False
         self.location_generator = location_generator
+        self._engine_type = engine_type
+        self._storage_type = storage_type
+        self._engine: VectorizedEngine = None
+        self._neighbor_index: NeighborIndex = None
+        self._person_cells: List[Cell] = []
+        self._counters = RumourCounters()
+        # the active frontier, ids of the persons who heard the rumour last turn / are in cooldown.
+        # spread_rumor and next_turn only touch those, everybody else has nothing to update
+        self._heard_rumour_last_turn_ids: Set[int] = set()
+        self._in_cooldown_ids: Set[int] = set()
+        # the turn every person (by id) first heard the rumour at, NEVER_HEARD if it didn't
+        self._first_heard_turn: np.ndarray = None
+        # whether every person (by id) heard the rumour, so the heard grid is built without visiting the cells
+        self._heard_rumour_sometime: np.ndarray = None
+        # ids of the persons who first heard the rumour in the last turn (or were the first spreader)
+        self._newly_heard_rumour_sometime_ids: List[int] = []
+        self._track_first_heard_turn = track_first_heard_turn or engine_type == EngineType.Objects
         self.cool_down_l = cool_down_l
+        self.turn = 0
+        # opt-in per phase timings and counts of spread_rumor, nothing is measured while it is None
+        self.phase_stats: PhaseStats = None
         self.doubt_level_locations_dict = None
-        self.persons_location: Dict[Location, PersonCell] = {}
+        # sorted flat indices (row * n_cols + col) of the person cells and their DoubtLevel values. the vectorized
+        # engine's doubt grid holds the same, so they are released once it is created (see nbytes_per_cell)
+        self.persons_indices: np.ndarray = None
+        self.persons_doubt_levels: np.ndarray = None
+        self._n_persons = 0
+        self._persons_location = None
         self._n_rows = n_rows
         self._n_cols = n_cols
         self._policy = policy
@@ -213,10 +457,13 @@ class EnvMap:
         self._persons_distribution = persons_distribution
         self._matrix: List[List[Cell]] = self._create_matrix(n_rows=n_rows, n_cols=n_cols)
         self._num_dimensions = 2
-        self.init_matrix(location_shape=location_shape, distribution_rule=distribution_rule)
 
-    @staticmethod
-    def _create_matrix(n_rows: int, n_cols: int) -> typing.List[typing.List[typing.Any]]:
+    def _create_matrix(self, n_rows: int, n_cols: int) -> typing.List[typing.List[typing.Any]]:
+        if self._engine_type == EngineType.Vectorized:
+            # replaced by a CellGridView over the engine arrays once the engine is created
+            return None
+        if self._storage_type == StorageType.Sparse:
+            return SparseCellGrid(n_rows=n_rows, n_cols=n_cols)
         matrix = []
         for r in range(n_rows):
             row = []
@@ -225,88 +472,140 @@ class EnvMap:
             matrix.append(row)
         return matrix
 
-    @staticmethod
-    def _get_n_doubt_level_dict(number_of_persons: int, persons_distribution):
-        n_doubt_level_dict = {}
-        for doubt_level in DoubtLevel:
-            n_doubt_level_dict[doubt_level] = int(
-                number_of_persons * persons_distribution[doubt_level]
-            )
-        return n_doubt_level_dict
+    @property
+    def n_persons(self) -> int:
+        return self._n_persons
 
-    @staticmethod
-    def _sample_for_each_doubt_level(persons_location, persons_distribution):
-        n_persons = len(persons_location)
-        n_doubt_level_dict = EnvMap._get_n_doubt_level_dict(
-            number_of_persons=n_persons, persons_distribution=persons_distribution
-        )
-        doubt_level_locations_dict = {}
-        for doubt_level in DoubtLevel:
-            n_doubt_level = n_doubt_level_dict[doubt_level]
-            n_doubt_level_randomized_locations = random.sample(
-                list(persons_location), k=n_doubt_level
-            )
-            for loca in n_doubt_level_randomized_locations:
-                doubt_level_locations_dict[loca] = doubt_level
-            persons_location = list(
-                set(persons_location) - set(n_doubt_level_randomized_locations)
-            )
-        return doubt_level_locations_dict
+    def _get_persons_indices(self) -> np.ndarray:
+        # found in the vectorized engine's doubt grid once they were released
+        if self.persons_indices is not None:
+            return self.persons_indices
+        return np.flatnonzero(self._engine.doubt.ravel() != EMPTY_DOUBT_LEVEL).astype(self._flat_indices_dtype())
+
+    def _get_persons_doubt_levels(self) -> np.ndarray:
+        if self.persons_doubt_levels is not None:
+            return self.persons_doubt_levels
+        return self._engine.doubt.ravel()[self._get_persons_indices()]
+
+    def _flat_indices_dtype(self) -> np.dtype:
+        return flat_indices_dtype(self._n_rows * self._n_cols)
+
+    @property
+    def persons_location(self):
+        # set of the (row, col) locations of the persons, built on first use
+        if self._persons_location is None:
+            self._persons_location = indices_to_locations(self._get_persons_indices(), self._n_cols)
+        return self._persons_location
+
+    def _get_sorted_persons_location(self) -> List[Location]:
+        rows, cols = np.divmod(self.persons_indices, self._n_cols)
+        return [Location(x=x, y=y) for x, y in zip(rows.tolist(), cols.tolist())]
 
     def init_matrix(self, location_shape: LocationShape, distribution_rule):
         # init matrix with cells
         n_person_cells = int(self._n_cols * self._n_rows * self._population_density)
 
         if location_shape == LocationShape.Random:
-            self.persons_location = self.location_generator.random_locations(n_person_cells=n_person_cells,
-                                                                             n_cols=self._n_cols,
-                                                                             n_rows=self._n_rows)
+            persons_indices = self.location_generator.random_indices(n_person_cells=n_person_cells,
+                                                                     n_cols=self._n_cols,
+                                                                     n_rows=self._n_rows,
+                                                                     rng=self.rng)
         elif location_shape == LocationShape.Lines:
-            self.persons_location = self.location_generator.lines_location(n_person_cells=n_person_cells,
-                                                                           n_cols=self._n_cols,
-                                                                           n_rows=self._n_rows)
+            persons_indices = self.location_generator.lines_indices(n_person_cells=n_person_cells,
+                                                                    n_cols=self._n_cols,
+                                                                    n_rows=self._n_rows)
         elif location_shape == LocationShape.Square:
-            self.persons_location = self.location_generator.square_location(n_person_cells=n_person_cells,
-                                                                            n_cols=self._n_cols,
-                                                                            n_rows=self._n_rows)
+            persons_indices = self.location_generator.square_indices(n_person_cells=n_person_cells,
+                                                                     n_cols=self._n_cols,
+                                                                     n_rows=self._n_rows)
         elif location_shape == LocationShape.DavidStar:
-            self.persons_location = self.location_generator.david_star_locations(n_person_cells=n_person_cells,
-                                                                            n_cols=self._n_cols,
-                                                                            n_rows=self._n_rows)
+            persons_indices = self.location_generator.david_star_indices(n_person_cells=n_person_cells,
+                                                                         n_cols=self._n_cols,
+                                                                         n_rows=self._n_rows)
         elif location_shape == LocationShape.Frame:
-            self.persons_location = self.location_generator.frame_location(n_person_cells=n_person_cells,
-                                                                            n_cols=self._n_cols,
-                                                                            n_rows=self._n_rows)
-
+            persons_indices = self.location_generator.frame_indices(n_person_cells=n_person_cells,
+                                                                    n_cols=self._n_cols,
+                                                                    n_rows=self._n_rows)
+        self.persons_indices = persons_indices.astype(self._flat_indices_dtype(), copy=False)
+        self._n_persons = len(persons_indices)
+        self._persons_location = None
+
+        # a doubt level for every person, aligned with persons_indices
+        n_persons = len(persons_indices)
         if distribution_rule == DistributionRule.Space:
-            self.doubt_level_locations_dict = self.location_generator.doubt_sample_easy_believer_next_to_not(
-                persons_location=self.persons_location
+            self.persons_doubt_levels = self.location_generator.doubt_levels_easy_believer_next_to_not(
+                n_persons=n_persons, rng=self.rng
             )
         elif distribution_rule == DistributionRule.K_Space:
-            self.doubt_level_locations_dict = self.location_generator.doubt_sample_easy_believer_next_to_k_hard_believers(
-                persons_location=self.persons_location
+            self.persons_doubt_levels = self.location_generator.doubt_levels_easy_believer_next_to_k_hard_believers(
+                n_persons=n_persons, rng=self.rng
             )
         elif distribution_rule == DistributionRule.Line_Space:
-            self.doubt_level_locations_dict =self.location_generator.doubt_sample_line_between_easy_believer_hard_believers(
-                persons_location=self.persons_location,easy_doubt=[DoubtLevel.S1],hard_doubt=[DoubtLevel.S4])
+            self.persons_doubt_levels = self.location_generator.doubt_levels_line_between_easy_believer_hard_believers(
+                persons_indices=persons_indices, n_cols=self._n_cols,
+                easy_doubt=[DoubtLevel.S1], hard_doubt=[DoubtLevel.S4], rng=self.rng)
         else:
             # default (Random)
-            self.doubt_level_locations_dict = self._sample_for_each_doubt_level(
-                persons_location=self.persons_location,
+            self.persons_doubt_levels = self.location_generator.doubt_levels_random(
+                n_persons=n_persons,
                 persons_distribution=self._persons_distribution,
+                rng=self.rng,
             )
-        self._init_matrix_cells(
-            doubt_level_locations_dict=self.doubt_level_locations_dict
-        )
+        if self._engine_type == EngineType.Vectorized:
+            self._engine = self._create_vectorized_engine()
+            self._matrix = CellGridView(self._engine)
+        else:
+            self.doubt_level_locations_dict = {
+                location: DoubtLevel(value)
+                for location, value in zip(self._get_sorted_persons_location(), self.persons_doubt_levels.tolist())
+            }
+            self._init_matrix_cells(
+                doubt_level_locations_dict=self.doubt_level_locations_dict
+            )
+            self._init_neighbor_index()
 
         self._init_first_spread_rumor()
+        if self._engine is not None:
+            self._release_persons()
+
+    def _release_persons(self) -> None:
+        # the vectorized engine's doubt grid holds the persons, their flat indices and doubt levels would take
+        # 5 more bytes per person on top of the engine's 3 per square
+        self.persons_indices = None
+        self.persons_doubt_levels = None
+
+    def _vectorized_engine_rules(self) -> Dict:
+        if self._policy not in POLICY_NEIGHBOR_OFFSETS:
+            raise Exception(f"Policy {self._policy} is not supported by the vectorized engine")
+        neighbor_offsets, wrap = POLICY_NEIGHBOR_OFFSETS[self._policy]
+        return dict(
+            cool_down_l=self.cool_down_l,
+            neighbor_offsets=neighbor_offsets,
+            wrap=wrap,
+            probability_to_believe=PROBABILITY_TO_BELIEVE,
+            min_doubt_level=MIN_DOUBT_LEVEL,
+            rng=self.rng,
+        )
+
+    def _create_vectorized_engine(self):
+        doubt_levels = np.full((self._n_rows, self._n_cols), EMPTY_DOUBT_LEVEL, dtype=np.int8)
+        doubt_levels.ravel()[self.persons_indices] = self.persons_doubt_levels
+        return VectorizedEngine(
+            doubt_levels=doubt_levels,
+            track_first_heard_turn=self._track_first_heard_turn,
+            **self._vectorized_engine_rules()
+        )
 
     def _init_matrix_cells(self, doubt_level_locations_dict: Dict[Tuple[int, int], DoubtLevel]):
         for (x, y), doubt_level in doubt_level_locations_dict.items():
             self._matrix[x][y] = PersonCell(
                 state=doubt_level,
                 position=Location(x=x, y=y),
-                cool_down_episode_countdown=self.cool_down_l)
+                cool_down_episode_countdown=self.cool_down_l,
+                counters=self._counters)
+        if self._storage_type == StorageType.Sparse:
+            # empty squares are implicit
+            return
         for row in range(self._n_rows):
             for col in range(self._n_cols):
                 if self._matrix[row][col] is None:
@@ -314,109 +613,462 @@ class EnvMap:
                         position=Location(x=row, y=col)
                     )
 
-    def _get_all_neighbors_location(self, location: Location):
-        all_neighbors = Counter()
-        for neighbor_location in self._policy(location):
-            if neighbor_location in self.persons_location:
-                all_neighbors.update([neighbor_location])
-        return all_neighbors
+    def get_bound_policy(self) -> Callable:
+        # the policy with this map's dimensions, so it wraps / clips at the map's own edges.
+        # a policy(location) that doesn't take them is used as is
+        if not policy_takes_dimensions(self._policy):
+            return self._policy
+        return functools.partial(self._policy, n_rows=self._n_rows, n_cols=self._n_cols)
+
+    def _init_neighbor_index(self):
+        # the policy is compiled once per map, person ids index both the neighbor index and _person_cells
+        self._neighbor_index = NeighborIndex(
+            locations=self._get_sorted_persons_location(),
+            policy=self.get_bound_policy(),
+        )
+        self._person_cells = [self._matrix[x][y] for x, y in self._neighbor_index.locations]
+        self._first_heard_turn = np.full(len(self._person_cells), NEVER_HEARD, dtype=np.int32)
+        self._heard_rumour_sometime = np.zeros(len(self._person_cells), dtype=bool)
 
     def _init_first_spread_rumor(self) -> None:
         randomized_person_location = self._get_random_person_location()
+        if self._engine is not None:
+            self._engine.set_first_spreader(x=randomized_person_location.x, y=randomized_person_location.y)
+            self.events.emit(FIRST_SPREADER, self, randomized_person_location)
+            return
         first_spreader: PersonCell = self._matrix[randomized_person_location.x][randomized_person_location.y]
         first_spreader.toggle_heard_rumour_sometime()
         first_spreader.set_heard_rumour_last_turn(True)
         first_spreader.set_n_cool_down_episode_countdown(n=0)
-        print(f"first spreader:{first_spreader}")
+        first_spreader_id = self._neighbor_index.ids[randomized_person_location]
+        self._heard_rumour_last_turn_ids.add(first_spreader_id)
+        self._first_heard_turn[first_spreader_id] = self.turn
+        self._heard_rumour_sometime[first_spreader_id] = True
+        self._newly_heard_rumour_sometime_ids = [first_spreader_id]
+        self.events.emit(FIRST_SPREADER, self, randomized_person_location)
 
     def spread_rumor(self):
+        self.turn += 1
+        if self._engine is not None:
+            self._engine.spread_rumor(phase_stats=self.phase_stats)
+            self._emit_turn_events()
+            return
+        phase_stats = self.phase_stats
+        if phase_stats is not None:
+            phase_stats.start_turn()
         # iterate over matrix,  spread rumour and create the next turn's matrix
 
         # calc who can spread rumour in this episode
-        rumour_spreaders: Dict[Location, PersonCell] = {}
-        for row, col in self.persons_location:
-            if self._matrix[row][col].can_spread_rumour():
-                rumour_spreaders[Location(x=row, y=col)] = self._matrix[row][col]
+        rumour_spreaders_ids = [
+            person_id for person_id in self._heard_rumour_last_turn_ids
+            if self._person_cells[person_id].can_spread_rumour()
+        ]
+        if phase_stats is not None:
+            phase_stats.end_phase("find_spreaders")
 
         # Count number of times each cell got rumour
-        total_rumour_spreads_in_episode = Counter()
-        for spread_rumour_location in rumour_spreaders:
-            neighbors = self._get_all_neighbors_location(spread_rumour_location)
-            total_rumour_spreads_in_episode.update(neighbors)
+        neighbors_ids, numbers_heard_about_rumour = self._neighbor_index.count_hits(rumour_spreaders_ids)
+        if phase_stats is not None:
+            phase_stats.end_phase("count_hits")
 
         # update the rumour spreaders in this episode: RST cool time, cooldown to False, heard rumour to False
-        for rumour_spreader_location in rumour_spreaders:
-            rumour_spreader: PersonCell = self._matrix[rumour_spreader_location.x][rumour_spreader_location.y]
+        for rumour_spreader_id in rumour_spreaders_ids:
+            rumour_spreader: PersonCell = self._person_cells[rumour_spreader_id]
             rumour_spreader.set_heard_rumour_last_turn(False)
             rumour_spreader.reset_n_cool_down_episodes_countdown()
             rumour_spreader.set_is_in_cooldown(True)
-
-        # Calculate who believes the rumour
-        rumour_believers: Dict[Location, Cell] = {}
-        for neighbor_location, number_heard_about_rumour in total_rumour_spreads_in_episode.items():
-            cell = self._matrix[neighbor_location.x][neighbor_location.y]
+            self._heard_rumour_last_turn_ids.discard(rumour_spreader_id)
+            self._in_cooldown_ids.add(rumour_spreader_id)
+        if phase_stats is not None:
+            phase_stats.end_phase("reset_spreaders")
+
+        # Calculate who believes the rumour, one batched draw for the listeners (neighbors not in cooldown),
+        # in person id order like the vectorized engine, so both engines consume the generator the same way
+        listeners = [
+            (neighbor_id, number_heard_about_rumour)
+            for neighbor_id, number_heard_about_rumour
+            in zip(neighbors_ids.tolist(), numbers_heard_about_rumour.tolist())
+            if not self._person_cells[neighbor_id].is_in_cooldown()
+        ]
+        draws = self.rng.random(len(listeners)).tolist()
+        rumour_believers_ids: List[int] = []
+        for (neighbor_id, number_heard_about_rumour), draw in zip(listeners, draws):
+            cell = self._person_cells[neighbor_id]
             # Check who got the rumour twice+ (will cause probability to believe deduct).
-            if cell.should_believe_to_rumour(number_heard_about_rumour):
-                rumour_believers[neighbor_location] = cell
+            if cell.should_believe_to_rumour(number_heard_about_rumour, draw):
+                rumour_believers_ids.append(neighbor_id)
 
         # update the state of cells that were told the rumour in this episode
-        for location, rumour_believer in rumour_believers.items():
+        self._newly_heard_rumour_sometime_ids = []
+        for rumour_believer_id in rumour_believers_ids:
+            rumour_believer: PersonCell = self._person_cells[rumour_believer_id]
+            if not rumour_believer.did_hear_rumour_sometime():
+                self._first_heard_turn[rumour_believer_id] = self.turn
+                self._newly_heard_rumour_sometime_ids.append(rumour_believer_id)
             rumour_believer.was_told_rumour()
+            self._heard_rumour_last_turn_ids.add(rumour_believer_id)
+        self._heard_rumour_sometime[self._newly_heard_rumour_sometime_ids] = True
+        if phase_stats is not None:
+            phase_stats.end_phase("draw_beliefs")
 
         # Prepare for next turn (for example: dec cooldown values)
         self.next_turn()
+        if phase_stats is not None:
+            phase_stats.end_phase("next_turn")
+            phase_stats.end_turn(
+                n_spreaders=len(rumour_spreaders_ids),
+                n_hits=numbers_heard_about_rumour.sum(),
+                n_listeners=len(listeners),
+                n_believers=len(rumour_believers_ids),
+            )
+        self._emit_turn_events()
+
+    def _emit_turn_events(self) -> None:
+        self.events.emit(TURN_END, self)
+        # is_quiescent is only checked when somebody listens
+        if not self._reported_quiescent and self.events.has_subscribers(QUIESCENT) and self.is_quiescent():
+            self._reported_quiescent = True
+            self.events.emit(QUIESCENT, self)
 
     def next_turn(self):
-        for row, col in self.persons_location:
-            self._matrix[row][col].next_turn()
+        if self._engine is not None:
+            self._engine.next_turn()
+            return
+        for person_id in self._heard_rumour_last_turn_ids | self._in_cooldown_ids:
+            self._person_cells[person_id].next_turn()
+        self._in_cooldown_ids = {
+            person_id for person_id in self._in_cooldown_ids if self._person_cells[person_id].is_in_cooldown()
+        }
+
+    def is_quiescent(self) -> bool:
+        # nobody heard the rumour last turn and nobody is in cooldown - the map will not change anymore
+        if self._engine is not None:
+            return self._engine.is_quiescent()
+        return not self._heard_rumour_last_turn_ids and not self._in_cooldown_ids
+
+    def run(self, n_turns: int, stop_when_quiescent: bool = True, fill_remaining: bool = True,
+            recorder=None) -> List[float]:
+        # spreads the rumour n_turns times, returns the believers percentage after every turn.
+        # once the map is quiescent the percentage cannot change, so the run stops early and
+        # (if fill_remaining) the rest of the series is filled with the final value.
+        # with a recorder (history_recorder.HistoryRecorder) the state after every turn is recorded
+        believers = []
+        for i in range(n_turns):
+            self.spread_rumor()
+            if recorder is not None:
+                recorder.record(self)
+            believers.append(self.calculate_percentage_of_believers())
+            if stop_when_quiescent and self.is_quiescent():
+                if fill_remaining:
+                    believers.extend([believers[-1]] * (n_turns - i - 1))
+                break
+        return believers
 
     def _get_random_person_location(self) -> Location:
-        x, y = random.choice(list(self.persons_location))
+        x, y = divmod(int(self.persons_indices[self.rng.integers(self.n_persons)]), self._n_cols)
         return Location(x=x, y=y)
 
+    def get_state_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # doubt level, flags and cooldown countdown grids, in the vectorized engine's compact format
+        if self._engine is not None:
+            return self._engine.doubt, self._engine.flags, self._engine.countdown
+        if self.cool_down_l > MAX_COOL_DOWN_L:
+            raise Exception(f"Cool down {self.cool_down_l} does not fit the compact format, max:{MAX_COOL_DOWN_L}")
+        # flags and countdown by person id. the persons out of the active frontier never heard the rumour (full
+        # countdown) or heard it and finished the cooldown (countdown 0), only the frontier's cells are read
+        last_turn_ids = np.fromiter(self._heard_rumour_last_turn_ids, dtype=np.int64)
+        in_cooldown_ids = np.fromiter(self._in_cooldown_ids, dtype=np.int64)
+        persons_flags = self._heard_rumour_sometime.astype(np.uint8) * HEARD_RUMOUR_SOMETIME
+        persons_flags[last_turn_ids] |= HEARD_RUMOUR_LAST_TURN
+        persons_flags[in_cooldown_ids] |= IN_COOLDOWN
+        persons_countdown = np.where(self._heard_rumour_sometime, 0, self.cool_down_l).astype(np.uint8)
+        frontier_ids = np.union1d(last_turn_ids, in_cooldown_ids)
+        persons_countdown[frontier_ids] = [
+            self._person_cells[person_id].get_n_cool_down_episodes_countdown() for person_id in frontier_ids.tolist()
+        ]
+        doubt = np.full((self._n_rows, self._n_cols), EMPTY_DOUBT_LEVEL, dtype=np.int8)
+        flags = np.zeros((self._n_rows, self._n_cols), dtype=np.uint8)
+        countdown = np.zeros((self._n_rows, self._n_cols), dtype=np.uint8)
+        doubt.ravel()[self.persons_indices] = self.persons_doubt_levels
+        flags.ravel()[self.persons_indices] = persons_flags
+        countdown.ravel()[self.persons_indices] = persons_countdown
+        return doubt, flags, countdown
+
+    def save(self, path: str) -> None:
+        # binary snapshot of the whole state, see EnvMap.load
+        if self._policy.__name__ not in POLICIES_BY_NAME:
+            raise Exception(f"Policy {self._policy} can not be saved, known policies:{list(POLICIES_BY_NAME)}")
+        doubt, flags, countdown = self.get_state_arrays()
+        header = {
+            "n_rows": self._n_rows,
+            "n_cols": self._n_cols,
+            "population_density": self._population_density,
+            "persons_distribution": {
+                doubt_level.name: share for doubt_level, share in self._persons_distribution.items()
+            },
+            "policy": self._policy.__name__,
+            "cool_down_l": self.cool_down_l,
+            "engine_type": self._engine_type.name,
+            "storage_type": self._storage_type.name,
+            "turn": self.turn,
+            "rng_state": self.rng.bit_generator.state,
+            # the running counters, so a load does not have to recount them from the flags grid
+            "counters": {
+                "n_heard_rumour_sometime_per_doubt_level": self._n_heard_rumour_sometime_per_doubt_level_value(),
+                "n_heard_rumour_last_turn": self.count_rumour_spreaders(),
+                "n_in_cooldown": self.count_in_cooldown(),
+            },
+        }
+        arrays = {
+            "doubt": doubt,
+            "flags": flags,
+            "countdown": countdown,
+            # the persons as well, so a load does not have to find them in the doubt grid
+            "persons_indices": self._get_persons_indices(),
+            "persons_doubt_levels": self._get_persons_doubt_levels(),
+        }
+        if self._track_first_heard_turn:
+            arrays["first_heard_turn"] = self.first_heard_turn_grid()
+        write_snapshot(path, header=header, arrays=arrays)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, events: EventBus = None) -> "EnvMap":
+        # restores a map saved with EnvMap.save, including the turn number and the random state, so it continues
+        # exactly like the saved map would have. with mmap the vectorized engine works on copy-on-write memory maps
+        # of the snapshot, so every load is an independent fork and the file is never modified. the persons and
+        # the counters are saved too, so loading reads no grid and a page is only read when a turn first uses it
+        header, arrays = read_snapshot(path, mmap=mmap)
+        env_map = cls.__new__(cls)
+        env_map._init_attributes(
+            n_rows=header["n_rows"],
+            n_cols=header["n_cols"],
+            population_density=header["population_density"],
+            persons_distribution={DoubtLevel[name]: share for name, share in header["persons_distribution"].items()},
+            policy=POLICIES_BY_NAME[header["policy"]],
+            cool_down_l=header["cool_down_l"],
+            location_generator=PersonsLocationGenerator(),
+            engine_type=EngineType[header["engine_type"]],
+            storage_type=StorageType[header["storage_type"]],
+            rng=np.random.Generator(getattr(np.random, header["rng_state"]["bit_generator"])()),
+            events=events,
+            track_first_heard_turn="first_heard_turn" in arrays,
+        )
+        env_map.rng.bit_generator.state = header["rng_state"]
+        env_map.turn = header["turn"]
+        env_map._restore_state(**arrays, counters=header.get("counters"))
+        return env_map
+
+    def _restore_state(
+            self,
+            doubt: np.ndarray,
+            flags: np.ndarray,
+            countdown: np.ndarray,
+            first_heard_turn: np.ndarray = None,
+            persons_indices: np.ndarray = None,
+            persons_doubt_levels: np.ndarray = None,
+            counters: Dict = None
+    ) -> None:
+        # the snapshots of older versions have no persons or counters, they are found / recounted from the grids
+        if persons_indices is None:
+            persons_indices = np.flatnonzero(np.asarray(doubt).ravel() != EMPTY_DOUBT_LEVEL).astype(
+                self._flat_indices_dtype()
+            )
+            persons_doubt_levels = np.asarray(doubt).ravel()[persons_indices].astype(np.int8)
+        self._n_persons = len(persons_indices)
+        if self._engine_type == EngineType.Vectorized:
+            self._engine = VectorizedEngine.from_state(
+                doubt=doubt, flags=flags, countdown=countdown, first_heard_turn=first_heard_turn, turn=self.turn,
+                counters=counters, **self._vectorized_engine_rules()
+            )
+            self._matrix = CellGridView(self._engine)
+            return
+        self.persons_indices = persons_indices
+        self.persons_doubt_levels = persons_doubt_levels
+        self.doubt_level_locations_dict = {
+            location: DoubtLevel(value)
+            for location, value in zip(self._get_sorted_persons_location(), self.persons_doubt_levels.tolist())
+        }
+        self._init_matrix_cells(doubt_level_locations_dict=self.doubt_level_locations_dict)
+        self._init_neighbor_index()
+        if first_heard_turn is not None:
+            self._first_heard_turn[:] = np.asarray(first_heard_turn).ravel()[self.persons_indices]
+        self._heard_rumour_sometime[:] = (np.asarray(flags).ravel()[self.persons_indices] & HEARD_RUMOUR_SOMETIME) != 0
+        for person_id, (location, cell) in enumerate(zip(self._neighbor_index.locations, self._person_cells)):
+            if flags[location] & HEARD_RUMOUR_SOMETIME:
+                cell.toggle_heard_rumour_sometime()
+            if flags[location] & HEARD_RUMOUR_LAST_TURN:
+                cell.set_heard_rumour_last_turn(True)
+                self._heard_rumour_last_turn_ids.add(person_id)
+            if flags[location] & IN_COOLDOWN:
+                cell.set_is_in_cooldown(True)
+                self._in_cooldown_ids.add(person_id)
+            cell.set_n_cool_down_episode_countdown(int(countdown[location]))
+
+    def get_vectorized_engine(self) -> VectorizedEngine:
+        if self._engine is None:
+            raise Exception(f"EnvMap was created with engine type:{self._engine_type}, not {EngineType.Vectorized}")
+        return self._engine
+
+    def heard_rumour_sometime_grid(self, rows: slice = slice(None), cols: slice = slice(None)) -> np.ndarray:
+        # boolean grid of the persons who heard the rumour, for every engine. rows and cols select a region,
+        # only its squares are read (the whole n_rows x n_cols map by default)
+        if self._engine is not None:
+            return (self._engine.flags[rows, cols] & HEARD_RUMOUR_SOMETIME) != 0
+        row_start, row_stop, _ = rows.indices(self._n_rows)
+        col_start, col_stop, _ = cols.indices(self._n_cols)
+        grid = np.zeros((max(row_stop - row_start, 0), max(col_stop - col_start, 0)), dtype=bool)
+        # persons ids are sorted by flat index, so the persons of the rows are a consecutive range of ids
+        first_person_id, stop_person_id = np.searchsorted(
+            self.persons_indices, [row_start * self._n_cols, row_stop * self._n_cols]
+        )
+        rows, cols = np.divmod(self.persons_indices[first_person_id:stop_person_id], self._n_cols)
+        in_cols = (cols >= col_start) & (cols < col_stop)
+        grid[rows[in_cols] - row_start, cols[in_cols] - col_start] = \
+            self._heard_rumour_sometime[first_person_id:stop_person_id][in_cols]
+        return grid
+
+    def newly_heard_rumour_sometime_indices(self) -> np.ndarray:
+        # flat indices (row * n_cols + col) of the persons who first heard the rumour in the last turn,
+        # for following heard_rumour_sometime_grid turn by turn without reading it
+        if self._engine is not None:
+            return self._engine.newly_heard_rumour_sometime
+        return self.persons_indices[self._newly_heard_rumour_sometime_ids]
+
+    def first_heard_turn_grid(self) -> np.ndarray:
+        # int32 (n_rows, n_cols) grid of the turn every person first heard the rumour at, NEVER_HEARD if it didn't
+        if not self._track_first_heard_turn:
+            raise Exception("The first heard turn is not tracked, create the map with track_first_heard_turn=True")
+        if self._engine is not None:
+            return self._engine.first_heard_turn
+        grid = np.full((self._n_rows, self._n_cols), NEVER_HEARD, dtype=np.int32)
+        grid.ravel()[self.persons_indices] = self._first_heard_turn
+        return grid
+
+    def _policy_wraps(self) -> bool:
+        return POLICY_NEIGHBOR_OFFSETS.get(self._policy, (None, False))[1]
+
+    def radius_by_turn(self) -> np.ndarray:
+        # farthest distance from the first spreader the rumour reached by every turn
+        return spread_stats.radius_by_turn(self.first_heard_turn_grid(), wrap=self._policy_wraps())
+
+    def front_speed(self) -> float:
+        return spread_stats.front_speed(self.radius_by_turn())
+
+    def arrival_time_histograms(self) -> Dict[DoubtLevel, np.ndarray]:
+        if self._engine is not None:
+            return spread_stats.arrival_time_histograms(self.first_heard_turn_grid(), doubt=self._engine.doubt)
+        doubt = np.full((self._n_rows, self._n_cols), EMPTY_DOUBT_LEVEL, dtype=np.int8)
+        doubt.ravel()[self.persons_indices] = self.persons_doubt_levels
+        return spread_stats.arrival_time_histograms(self.first_heard_turn_grid(), doubt=doubt)
+
+    def nbytes_per_cell(self) -> float:
+        # memory the map's arrays take per square: the engine state and its optional first heard turn grid, or
+        # the objects engine's per person arrays (its cells are python objects on top of that)
+        arrays = [self.persons_indices, self.persons_doubt_levels, self._first_heard_turn, self._heard_rumour_sometime]
+        nbytes = sum(array.nbytes for array in arrays if array is not None)
+        if self._engine is not None:
+            nbytes += sum(getattr(self._engine, name).nbytes for name in GRID_ARRAYS)
+            if self._engine.first_heard_turn is not None:
+                nbytes += self._engine.first_heard_turn.nbytes
+        return nbytes / (self._n_rows * self._n_cols)
+
+    def count_heard_rumour_sometime(self) -> int:
+        if self._engine is not None:
+            return self._engine.count_heard_rumour_sometime()
+        return self._counters.n_heard_rumour_sometime
+
+    def count_heard_rumour_sometime_per_doubt_level(self) -> Dict[DoubtLevel, int]:
+        if self._engine is not None:
+            counts = self._engine.n_heard_rumour_sometime_per_doubt_level
+            return {doubt_level: int(counts[doubt_level.value]) for doubt_level in DoubtLevel}
+        return dict(self._counters.n_heard_rumour_sometime_per_doubt_level)
+
+    def _n_heard_rumour_sometime_per_doubt_level_value(self) -> List[int]:
+        # indexed by doubt level value, like VectorizedEngine.n_heard_rumour_sometime_per_doubt_level
+        counts = [0] * (len(DoubtLevel) + 1)
+        for doubt_level, count in self.count_heard_rumour_sometime_per_doubt_level().items():
+            counts[doubt_level.value] = count
+        return counts
+
+    def count_rumour_spreaders(self) -> int:
+        # persons who heard the rumour last turn and spread it in the coming turn
+        if self._engine is not None:
+            return int(self._engine.n_heard_rumour_last_turn)
+        return self._counters.n_heard_rumour_last_turn
+
+    def count_in_cooldown(self) -> int:
+        if self._engine is not None:
+            return int(self._engine.n_in_cooldown)
+        return self._counters.n_in_cooldown
+
     def calculate_percentage_of_believers(self):
-        n_persons = len(self.persons_location)
-        cnt = 0
-        for x, y in self.persons_location:
-            cell = self._matrix[x][y]
-            if cell.did_hear_rumour_sometime():
-                cnt += 1
-        return cnt / n_persons
+        return self.count_heard_rumour_sometime() / self.n_persons
+
+
+def policy_takes_dimensions(policy: Callable) -> bool:
+    # whether the policy accepts the n_rows / n_cols keywords, the older policies take only the location
+    try:
+        parameters = inspect.signature(policy).parameters
+    except (TypeError, ValueError):
+        return False
+    if any(parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values()):
+        return True
+    return all(
+        name in parameters and parameters[name].kind != inspect.Parameter.POSITIONAL_ONLY
+        for name in ("n_rows", "n_cols")
+    )
 
 
-def wrap_all_around_policy(location: Location):
+# the policies get the dimensions of the map they run on, EnvMap binds them to its own n_rows / n_cols
+
+def wrap_all_around_policy(location: Location, n_rows: int = MATRIX_SIZE, n_cols: int = MATRIX_SIZE):
     for i in [-1, 0, 1]:
         for j in [-1, 0, 1]:
             if i == 0 and j == 0:
                 continue
-            neighbor_x = (location.x + i) % MATRIX_SIZE
-            neighbor_y = (location.y + j) % MATRIX_SIZE
+            neighbor_x = (location.x + i) % n_rows
+            neighbor_y = (location.y + j) % n_cols
             yield Location(neighbor_x, neighbor_y)
 
 
-def all_around_policy(location: Location):
+def all_around_policy(location: Location, n_rows: int = MATRIX_SIZE, n_cols: int = MATRIX_SIZE):
     for i in [-1, 0, 1]:
         for j in [-1, 0, 1]:
             if i == 0 and j == 0:
                 continue
             neighbor_x = location.x + i
             neighbor_y = location.y + j
-            if neighbor_x < 0 or neighbor_x >= MATRIX_SIZE or neighbor_y < 0 or neighbor_y >= MATRIX_SIZE:
+            if neighbor_x < 0 or neighbor_x >= n_rows or neighbor_y < 0 or neighbor_y >= n_cols:
                 continue
             yield Location(neighbor_x, neighbor_y)
 
 
-def four_directions_policy(location: Location):
+def four_directions_policy(location: Location, n_rows: int = MATRIX_SIZE, n_cols: int = MATRIX_SIZE):
     for diff in [-1, 1]:
         location_x = location.x + diff
         location_y = location.y + diff
-        if 0 <= location_y <= MATRIX_SIZE:
+        if 0 <= location_y < n_cols:
             yield Location(x=location.x, y=location_y)
-        if 0 <= location_x <= MATRIX_SIZE:
+        if 0 <= location_x < n_rows:
             yield Location(x=location_x, y=location.y)
 
 
+ALL_AROUND_OFFSETS = [(i, j) for i in [-1, 0, 1] for j in [-1, 0, 1] if not (i == 0 and j == 0)]
+FOUR_DIRECTIONS_OFFSETS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+# neighbor offsets and whether they wrap around the map edges, per policy (used by the vectorized engine)
+POLICY_NEIGHBOR_OFFSETS = {
+    wrap_all_around_policy: (ALL_AROUND_OFFSETS, True),
+    all_around_policy: (ALL_AROUND_OFFSETS, False),
+    four_directions_policy: (FOUR_DIRECTIONS_OFFSETS, False),
+}
+
+# policies by their id in the EnvMap snapshots
+POLICIES_BY_NAME = {policy.__name__: policy for policy in POLICY_NEIGHBOR_OFFSETS}
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     env_map = EnvMap(
         n_rows=MATRIX_SIZE,
         n_cols=MATRIX_SIZE,
@@ -425,9 +1077,7 @@ if __name__ == "__main__":
         cool_down_l=4,
         policy=all_around_policy,
         location_shape=LocationShape.Frame,
-        distribution_rule=DistributionRule.Random
+        distribution_rule=DistributionRule.Random,
+        events=EventBus(LoggingSink()),
     )
-    for i in range(100):
-        print(f"turn {i}==================")
-        env_map.spread_rumor()
-        print(env_map.calculate_percentage_of_believers())
+    env_map.run(100)
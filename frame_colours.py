@@ -0,0 +1,27 @@
+import numpy as np
+
+from vectorized_engine import HEARD_RUMOUR_SOMETIME
+
+BLACK = (0, 0, 0)
+WHITE = (255, 255, 255)
+GRAY = (128, 128, 128)
+RED = (255, 0, 0)
+# colour of the squares by their colour index: did not hear the rumour / heard it
+PALETTE = np.array([WHITE, BLACK], dtype=np.uint8)
+
+
+def colour_indices(env_map) -> np.ndarray:
+    # uint8 (n_rows, n_cols) grid of the index into PALETTE of every square
+    return env_map.heard_rumour_sometime_grid().astype(np.uint8)
+
+
+def colour_indices_from_flags(flags: np.ndarray) -> np.ndarray:
+    # the same from a flags grid, e.g. of a recorded turn (history_recorder.HistoryReader.get_state)
+    return ((flags & HEARD_RUMOUR_SOMETIME) != 0).astype(np.uint8)
+
+
+# colour of a block of squares by the share of them who heard the rumour, from WHITE (none) to BLACK (all),
+# the last index is the GRAY of the grid lines between zoomed in squares
+MAX_DENSITY_INDEX = 254
+GRID_LINE_INDEX = 255
+DENSITY_PALETTE = np.vstack([np.rint(np.linspace(WHITE, BLACK, MAX_DENSITY_INDEX + 1)), [GRAY]]).astype(np.uint8)
@@ -0,0 +1,139 @@
+import argparse
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+import frame_colours
+from frame_colours import PALETTE
+from history_recorder import HistoryReader
+
+# renders frames to image files without pygame or a display, the frames come from a live run or a recorded history
+FRAME_FILE_PATTERN = "frame_{:06d}.png"
+GIF_FILE_NAME = "animation.gif"
+DEFAULT_TILE_SIZE = 4
+DEFAULT_FRAME_DURATION_MS = 100
+# frames waiting to be encoded per worker, bounds the memory of a long run
+MAX_PENDING_FRAMES_PER_WORKER = 4
+
+
+def frame_image(colour_indices: np.ndarray, tile_size: int = DEFAULT_TILE_SIZE) -> Image.Image:
+    # palette image of the colour indices (see frame_colours), tile_size pixels per square
+    image = Image.fromarray(np.ascontiguousarray(colour_indices, dtype=np.uint8), mode="P")
+    image.putpalette(PALETTE.ravel().tolist())
+    if tile_size > 1:
+        image = image.resize((image.width * tile_size, image.height * tile_size), Image.NEAREST)
+    return image
+
+
+def save_frame(colour_indices: np.ndarray, path: str, tile_size: int = DEFAULT_TILE_SIZE) -> str:
+    frame_image(colour_indices, tile_size=tile_size).save(path)
+    return path
+
+
+def iter_run_frames(env_map, n_turns: int, stop_when_quiescent: bool = True) -> Iterator[Tuple[int, np.ndarray]]:
+    # (turn, colour indices) of the map as it is and after each of the next n_turns turns
+    yield env_map.turn, frame_colours.colour_indices(env_map)
+    for _ in range(n_turns):
+        env_map.spread_rumor()
+        yield env_map.turn, frame_colours.colour_indices(env_map)
+        if stop_when_quiescent and env_map.is_quiescent():
+            return
+
+
+def iter_history_frames(history: HistoryReader, start: int = None,
+                        stop: int = None) -> Iterator[Tuple[int, np.ndarray]]:
+    for turn, flags, _ in history.iter_states(start=start, stop=stop):
+        yield turn, frame_colours.colour_indices_from_flags(flags)
+
+
+def render_frames(
+        frames: Iterator[Tuple[int, np.ndarray]],
+        output_dir: str,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        pngs: bool = True,
+        gif: bool = False,
+        frame_duration_ms: int = DEFAULT_FRAME_DURATION_MS,
+        n_workers: int = None,
+        executor: ProcessPoolExecutor = None
+) -> List[str]:
+    # writes a PNG per frame (FRAME_FILE_PATTERN) and/or one animated GIF of all of them to output_dir,
+    # returns the written paths. the PNGs are encoded in a process pool, pass executor to share one pool
+    # between many renders (e.g. one per configuration)
+    os.makedirs(output_dir, exist_ok=True)
+    own_executor = executor is None and pngs
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+    # the window of frames in flight follows the pool the frames go to, a passed executor has its own size
+    # (and n_workers is not used). the executors keep their resolved number of workers in _max_workers
+    n_pool_workers = getattr(executor, "_max_workers", None) or n_workers or os.cpu_count() or 1
+    max_pending = MAX_PENDING_FRAMES_PER_WORKER * n_pool_workers
+    pending: List[Future] = []
+    paths = []
+    gif_frames = []
+    try:
+        for turn, colour_indices in frames:
+            if pngs:
+                if len(pending) >= max_pending:
+                    paths.append(pending.pop(0).result())
+                pending.append(executor.submit(
+                    save_frame, colour_indices, os.path.join(output_dir, FRAME_FILE_PATTERN.format(turn)), tile_size
+                ))
+            if gif:
+                gif_frames.append(frame_image(colour_indices, tile_size=tile_size))
+        paths.extend(future.result() for future in pending)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    if gif and gif_frames:
+        gif_path = os.path.join(output_dir, GIF_FILE_NAME)
+        gif_frames[0].save(
+            gif_path, save_all=True, append_images=gif_frames[1:], duration=frame_duration_ms, loop=0
+        )
+        paths.append(gif_path)
+    return paths
+
+
+def render_run(env_map, n_turns: int, output_dir: str, stop_when_quiescent: bool = True, **render_kwargs) -> List[str]:
+    return render_frames(
+        iter_run_frames(env_map, n_turns=n_turns, stop_when_quiescent=stop_when_quiescent),
+        output_dir=output_dir,
+        **render_kwargs,
+    )
+
+
+def render_history(history_path: str, output_dir: str, start: int = None, stop: int = None,
+                   **render_kwargs) -> List[str]:
+    return render_frames(
+        iter_history_frames(HistoryReader(history_path), start=start, stop=stop),
+        output_dir=output_dir,
+        **render_kwargs,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a recorded history to PNG frames and/or an animated GIF")
+    parser.add_argument("history_path")
+    parser.add_argument("output_dir")
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument("--start", type=int, default=None)
+    parser.add_argument("--stop", type=int, default=None)
+    parser.add_argument("--gif", action="store_true")
+    parser.add_argument("--no-pngs", action="store_true")
+    parser.add_argument("--frame-duration-ms", type=int, default=DEFAULT_FRAME_DURATION_MS)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    written = render_history(
+        args.history_path,
+        args.output_dir,
+        start=args.start,
+        stop=args.stop,
+        tile_size=args.tile_size,
+        pngs=not args.no_pngs,
+        gif=args.gif,
+        frame_duration_ms=args.frame_duration_ms,
+        n_workers=args.workers,
+    )
+    print(f"wrote {len(written)} files to {args.output_dir}")
@@ -0,0 +1,180 @@
+import json
+import os
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from vectorized_engine import HEARD_RUMOUR_SOMETIME
+
+# files of a history directory
+HEADER_FILE = "history.json"
+DOUBT_FILE = "doubt.npy"
+DATA_FILE = "data.bin"
+INDEX_FILE = "index.npy"
+
+DEFAULT_KEYFRAME_INTERVAL = 100
+RECORD_ALIGNMENT = 8
+
+# columns of the index, one row per recorded turn
+INDEX_OFFSET, INDEX_N_CELLS, INDEX_IS_KEYFRAME = range(3)
+
+
+def pack_state(flags: np.ndarray, countdown: np.ndarray) -> np.ndarray:
+    # the state of a square as one uint16: cooldown countdown in the high byte, flags in the low byte
+    return (countdown.astype(np.uint16) << 8) | flags
+
+
+def unpack_state(state: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return (state & 0xFF).astype(np.uint8), (state >> 8).astype(np.uint8)
+
+
+class HistoryRecorder:
+    """
+    Records the state of an EnvMap after every turn to a history directory, for replay with HistoryReader.
+    Every keyframe_interval turns the full state is stored, in between only the squares that changed.
+    Only the previous turn's state is kept in memory
+    """
+
+    def __init__(self, path: str, env_map, keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL):
+        if keyframe_interval < 1:
+            raise Exception(f"Invalid keyframe interval, it should be at least 1, not:{keyframe_interval}")
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, HEADER_FILE)):
+            raise Exception(f"History directory {path} already has a recording")
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        doubt, flags, countdown = env_map.get_state_arrays()
+        if doubt.ndim != 2:
+            raise Exception(f"Only a single map can be recorded, got state of shape:{doubt.shape}")
+        self._shape = doubt.shape
+        self._first_turn = env_map.turn
+        self._positions_dtype = np.dtype(np.uint32 if doubt.size <= np.iinfo(np.uint32).max else np.int64)
+        np.save(os.path.join(path, DOUBT_FILE), doubt)
+        self._data_file = open(os.path.join(path, DATA_FILE), "wb")
+        self._offset = 0
+        self._index = []
+        self._previous_state = None
+        # the state the map starts from is the first keyframe
+        self.record(env_map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def n_turns(self) -> int:
+        return len(self._index)
+
+    def record(self, env_map) -> None:
+        # call after every turn
+        _, flags, countdown = env_map.get_state_arrays()
+        state = pack_state(flags, countdown).ravel()
+        if self.n_turns % self.keyframe_interval == 0:
+            self._write_record(state.tobytes(), n_cells=state.size, is_keyframe=True)
+        else:
+            changed = np.flatnonzero(state != self._previous_state)
+            self._write_record(
+                changed.astype(self._positions_dtype).tobytes() + state[changed].tobytes(),
+                n_cells=changed.size,
+                is_keyframe=False,
+            )
+        self._previous_state = state
+
+    def _write_record(self, data: bytes, n_cells: int, is_keyframe: bool) -> None:
+        padding = -len(data) % RECORD_ALIGNMENT
+        self._data_file.write(data + b"\0" * padding)
+        self._index.append((self._offset, n_cells, is_keyframe))
+        self._offset += len(data) + padding
+
+    def close(self) -> None:
+        if self._data_file.closed:
+            return
+        self._data_file.close()
+        np.save(os.path.join(self.path, INDEX_FILE), np.array(self._index, dtype=np.int64).reshape(-1, 3))
+        header = {
+            "n_rows": self._shape[0],
+            "n_cols": self._shape[1],
+            "first_turn": self._first_turn,
+            "n_turns": self.n_turns,
+            "keyframe_interval": self.keyframe_interval,
+            "positions_dtype": self._positions_dtype.str,
+        }
+        with open(os.path.join(self.path, HEADER_FILE), "w") as f:
+            json.dump(header, f)
+
+
+class HistoryReader:
+    """
+    Random access to the turns of a recording made by HistoryRecorder.
+    The data file is memory mapped, a turn is rebuilt from the keyframe before it and the deltas since,
+    moving forward from the last rebuilt turn when possible so a sequential replay applies each delta once
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            header = json.load(f)
+        self.n_rows = header["n_rows"]
+        self.n_cols = header["n_cols"]
+        self.first_turn = header["first_turn"]
+        self.n_turns = header["n_turns"]
+        self.keyframe_interval = header["keyframe_interval"]
+        self._positions_dtype = np.dtype(header["positions_dtype"])
+        self.doubt = np.load(os.path.join(path, DOUBT_FILE))
+        self._index = np.load(os.path.join(path, INDEX_FILE))
+        data_path = os.path.join(path, DATA_FILE)
+        self._data = np.memmap(data_path, dtype=np.uint8, mode="r") if os.path.getsize(data_path) else None
+        self._cached_turn = None
+        self._cached_state = None
+
+    def __len__(self):
+        return self.n_turns
+
+    def _read_record(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        # the positions and states of record i, all the positions for a keyframe
+        offset, n_cells, is_keyframe = self._index[i]
+        if is_keyframe:
+            return None, np.frombuffer(self._data, dtype=np.uint16, count=n_cells, offset=offset)
+        positions = np.frombuffer(self._data, dtype=self._positions_dtype, count=n_cells, offset=offset)
+        states = np.frombuffer(
+            self._data, dtype=np.uint16, count=n_cells, offset=offset + n_cells * self._positions_dtype.itemsize
+        )
+        return positions, states
+
+    def get_packed_state(self, turn: int) -> np.ndarray:
+        # the packed state (see pack_state) of all the squares after the given turn, as a flat array
+        i = turn - self.first_turn
+        if not 0 <= i < self.n_turns:
+            raise IndexError(f"Turn {turn} was not recorded, recorded turns:{self.first_turn}-{self.turns_end - 1}")
+        keyframe = i - i % self.keyframe_interval
+        cached = None if self._cached_turn is None else self._cached_turn - self.first_turn
+        if cached is not None and keyframe <= cached <= i:
+            start, state = cached + 1, self._cached_state
+        else:
+            start, state = keyframe + 1, self._read_record(keyframe)[1].copy()
+        for j in range(start, i + 1):
+            positions, states = self._read_record(j)
+            state[positions] = states
+        self._cached_turn, self._cached_state = turn, state
+        return state.copy()
+
+    @property
+    def turns_end(self) -> int:
+        return self.first_turn + self.n_turns
+
+    def get_state(self, turn: int) -> Tuple[np.ndarray, np.ndarray]:
+        # flags and cooldown countdown grids after the given turn
+        flags, countdown = unpack_state(self.get_packed_state(turn))
+        return flags.reshape(self.n_rows, self.n_cols), countdown.reshape(self.n_rows, self.n_cols)
+
+    def heard_rumour_sometime_grid(self, turn: int) -> np.ndarray:
+        return (self.get_state(turn)[0] & HEARD_RUMOUR_SOMETIME) != 0
+
+    def iter_states(self, start: int = None, stop: int = None) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        # (turn, flags, countdown) for the turns in [start, stop), by default all the recorded turns
+        start = self.first_turn if start is None else start
+        stop = self.turns_end if stop is None else min(stop, self.turns_end)
+        for turn in range(start, stop):
+            flags, countdown = self.get_state(turn)
+            yield turn, flags, countdown
@@ -0,0 +1,109 @@
+import glob
+import os
+from typing import Dict, Iterator
+
+import numpy as np
+
+from DoubtLevel import DoubtLevel
+
+# columns of a metrics row, one row per replica per turn (turn is the turn the state is after, 1 for the first)
+METRICS_COLUMNS = {
+    "replica": np.int64,
+    "turn": np.int32,
+    "believers_percentage": np.float64,
+    "n_spreaders": np.int64,
+    "n_in_cooldown": np.int64,
+    **{f"n_heard_{doubt_level.name}": np.int64 for doubt_level in DoubtLevel},
+}
+CHUNK_FILE_PATTERN = "metrics_{:06d}.npz"
+CHUNK_FILE_GLOB = "metrics_*.npz"
+DEFAULT_CHUNK_SIZE = 100_000
+
+
+class MetricsWriter:
+    """
+    Streams per turn, per replica metrics to a directory of columnar npz chunk files.
+    At most chunk_size rows are buffered in memory, every full buffer is written as the next chunk
+    """
+
+    def __init__(self, directory: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+        if glob.glob(os.path.join(directory, CHUNK_FILE_GLOB)):
+            raise Exception(f"Metrics directory {directory} already has metrics chunks")
+        self._buffer = {name: np.empty(chunk_size, dtype=dtype) for name, dtype in METRICS_COLUMNS.items()}
+        self._n_buffered = 0
+        self._n_chunks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, replica, turn, believers_percentage, n_spreaders, n_in_cooldown, n_heard_per_doubt_level):
+        # writes one row per replica, every argument is a scalar or an array with a value per replica.
+        # n_heard_per_doubt_level has a column per DoubtLevel, in DoubtLevel order
+        replica = np.atleast_1d(replica)
+        n_heard_per_doubt_level = np.asarray(n_heard_per_doubt_level).reshape(len(replica), len(DoubtLevel))
+        columns = {
+            "replica": replica,
+            "turn": np.broadcast_to(turn, replica.shape),
+            "believers_percentage": np.broadcast_to(believers_percentage, replica.shape),
+            "n_spreaders": np.broadcast_to(n_spreaders, replica.shape),
+            "n_in_cooldown": np.broadcast_to(n_in_cooldown, replica.shape),
+            **{
+                f"n_heard_{doubt_level.name}": n_heard_per_doubt_level[:, i]
+                for i, doubt_level in enumerate(DoubtLevel)
+            },
+        }
+        n_rows = len(replica)
+        written = 0
+        while written < n_rows:
+            n_to_buffer = min(n_rows - written, self.chunk_size - self._n_buffered)
+            for name, values in columns.items():
+                self._buffer[name][self._n_buffered:self._n_buffered + n_to_buffer] = \
+                    values[written:written + n_to_buffer]
+            self._n_buffered += n_to_buffer
+            written += n_to_buffer
+            if self._n_buffered == self.chunk_size:
+                self.flush()
+
+    def write_env_map(self, replica: int, turn: int, env_map) -> None:
+        n_heard_per_doubt_level = env_map.count_heard_rumour_sometime_per_doubt_level()
+        self.write(
+            replica=replica,
+            turn=turn,
+            believers_percentage=env_map.calculate_percentage_of_believers(),
+            n_spreaders=env_map.count_rumour_spreaders(),
+            n_in_cooldown=env_map.count_in_cooldown(),
+            n_heard_per_doubt_level=[n_heard_per_doubt_level[doubt_level] for doubt_level in DoubtLevel],
+        )
+
+    def flush(self) -> None:
+        if self._n_buffered == 0:
+            return
+        path = os.path.join(self.directory, CHUNK_FILE_PATTERN.format(self._n_chunks))
+        np.savez(path, **{name: column[:self._n_buffered] for name, column in self._buffer.items()})
+        self._n_chunks += 1
+        self._n_buffered = 0
+
+    def close(self) -> None:
+        self.flush()
+
+
+def read_metrics(directory: str) -> Iterator[Dict[str, np.ndarray]]:
+    # lazily yields the chunks in the order they were written, as {column name: values}
+    for path in sorted(glob.glob(os.path.join(directory, CHUNK_FILE_GLOB))):
+        with np.load(path) as chunk:
+            yield {name: chunk[name] for name in chunk.files}
+
+
+def read_metrics_column(directory: str, name: str) -> np.ndarray:
+    # a single column of all the chunks, the other columns are not loaded
+    columns = []
+    for path in sorted(glob.glob(os.path.join(directory, CHUNK_FILE_GLOB))):
+        with np.load(path) as chunk:
+            columns.append(chunk[name])
+    return np.concatenate(columns) if columns else np.empty(0, dtype=METRICS_COLUMNS[name])
@@ -0,0 +1,41 @@
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+
+class NeighborIndex:
+    """
+    The neighbors of every person cell under a policy, compiled once per map.
+    Person ids are positions in `locations`, the neighbors of person i are
+    indices[indptr[i]:indptr[i + 1]] (CSR layout), only person cells are kept.
+    """
+
+    def __init__(self, locations: List[Tuple[int, int]], policy: Callable):
+        self.locations = locations
+        self.ids = {location: person_id for person_id, location in enumerate(locations)}
+        indptr = [0]
+        indices = []
+        for location in locations:
+            for neighbor_location in policy(location):
+                neighbor_id = self.ids.get(neighbor_location)
+                if neighbor_id is not None:
+                    indices.append(neighbor_id)
+            indptr.append(len(indices))
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def gather(self, person_ids: np.ndarray) -> np.ndarray:
+        # neighbor ids of all the given persons concatenated, a neighbor shared by k of them appears k times
+        person_ids = np.asarray(person_ids, dtype=np.int64)
+        starts = self.indptr[person_ids]
+        lengths = self.indptr[person_ids + 1] - starts
+        ends = np.cumsum(lengths)
+        positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - lengths), lengths)
+        return self.indices[positions]
+
+    def count_hits(self, person_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # ids of the neighbors of the given persons and how many of them each neighbor has
+        return np.unique(self.gather(person_ids), return_counts=True)
@@ -1,66 +1,82 @@
 import math
-import random
-from itertools import product
-from typing import List
+from typing import Dict, List
+
+import numpy as np
+
 from DoubtLevel import DoubtLevel
 
 
+# sizes of the david star relative to the smaller grid dimension (30 / 26 / -8 on a 100x100 grid)
+DAVID_STAR_TRIANGLE_HEIGHT = 0.3
+DAVID_STAR_TRIANGLE_WIDTH = 0.26
+DAVID_STAR_EXTRA = -0.08
+
+
+def flat_indices_dtype(n_cells: int) -> np.dtype:
+    # int32 flat indices take half the memory of int64 ones, enough for maps of up to 2**31 squares
+    return np.dtype(np.int32) if n_cells <= np.iinfo(np.int32).max + 1 else np.dtype(np.int64)
+
+
+def indices_to_locations(indices: np.ndarray, n_cols: int):
+    rows, cols = np.divmod(indices, n_cols)
+    return set(zip(rows.tolist(), cols.tolist()))
+
+
 class PersonsLocationGenerator:
-    @staticmethod
-    def random_locations(n_person_cells=None, n_cols=None, n_rows=None):
-        persons_location = random.sample(
-            population=list(product(range(n_rows), range(n_cols))),
-            k=n_person_cells,
-        )
-        return set(persons_location)
+    # the *_indices generators return the sorted flat indices (row * n_cols + col) of the person cells,
+    # the *_location(s) generators return the same cells as a set of (row, col) tuples.
+    # the random ones draw from the rng argument, or else from the generator's own rng
+    # (a numpy Generator, or a seed / SeedSequence to create one from; None seeds from the OS)
+
+    def __init__(self, rng=None):
+        self.rng: np.random.Generator = np.random.default_rng(rng)
+
+    def _get_rng(self, rng: np.random.Generator = None) -> np.random.Generator:
+        return rng if rng is not None else self.rng
+
+    def random_indices(self, n_person_cells=None, n_cols=None, n_rows=None, rng: np.random.Generator = None):
+        rng = self._get_rng(rng)
+        return np.sort(rng.choice(n_rows * n_cols, size=n_person_cells, replace=False))
 
     @staticmethod
-    def lines_location(n_person_cells=None, n_cols=None, n_rows=None):
-        counter = 0
-        locations = set()
-        for i in range(n_rows):
-            for j in range(n_cols):
-                if counter >= n_person_cells:
-                    return locations
-                locations.add((i, j))
-                counter += 1
-        return locations
+    def lines_indices(n_person_cells=None, n_cols=None, n_rows=None):
+        return np.arange(min(n_person_cells, n_rows * n_cols))
 
     @staticmethod
-    def square_location(n_person_cells=None, n_cols=None, n_rows=None):
-        locations = set()
+    def square_indices(n_person_cells=None, n_cols=None, n_rows=None):
         root = int(math.floor(math.sqrt(n_person_cells)))
-        print(f"root:{root}")
         assert math.pow(root, 2) == n_person_cells, "number of persons cell when square shape used should be n^2 for natural n"
-        margin_row = int((n_cols-root)/2)
-        margin_col = int((n_rows-root)/2)
-        for i in range(margin_row, margin_row+root):
-            for j in range(margin_col, margin_col+root):
-                locations.add((i, j))
-        return locations
+        margin_row = int((n_rows - root) / 2)
+        margin_col = int((n_cols - root) / 2)
+        rows = np.arange(margin_row, margin_row + root)
+        cols = np.arange(margin_col, margin_col + root)
+        return (rows[:, None] * n_cols + cols[None, :]).ravel()
 
     @staticmethod
-    def frame_location(n_person_cells=None, n_cols=None, n_rows=None):
-        locations = set()
-        for i in range(n_cols):
-            locations.add((0,i))
-            locations.add((n_rows-1,i))
-        for j in range(n_rows):
-            locations.add((j,0))
-            locations.add((j,n_cols-1))
-        return locations
+    def frame_indices(n_person_cells=None, n_cols=None, n_rows=None):
+        # first row, the first and last col of the middle rows, last row - already sorted, O(n_rows + n_cols)
+        first_row = np.arange(n_cols)
+        if n_rows == 1:
+            return first_row
+        edge_cols = np.unique([0, n_cols - 1])
+        middle_rows = (np.arange(1, n_rows - 1)[:, None] * n_cols + edge_cols[None, :]).ravel()
+        return np.concatenate([first_row, middle_rows, (n_rows - 1) * n_cols + first_row])
 
     @staticmethod
-    def david_star_locations(n_person_cells=None, n_cols=None, n_rows=None):
-        locations = set()
+    def david_star_mask(n_cols=None, n_rows=None):
+        # i runs over the rows (the "y" coordinates below), j over the cols (the "x" coordinates)
+        i = np.arange(n_rows)[:, None]
+        j = np.arange(n_cols)[None, :]
+
         #center
-        center_x = n_rows/2
-        center_y = n_cols/2
+        center_x = n_cols / 2
+        center_y = n_rows / 2
 
-        #sized to make it look lit
-        triangle_height = 30
-        triangle_width = 26
-        extra = -8
+        #sized relatively to the grid to make it look lit
+        size = min(n_rows, n_cols)
+        triangle_height = int(DAVID_STAR_TRIANGLE_HEIGHT * size)
+        triangle_width = int(DAVID_STAR_TRIANGLE_WIDTH * size)
+        extra = int(DAVID_STAR_EXTRA * size)
 
         #vertices of the upper triangle
         upper_left_x = center_x - triangle_width // 2
@@ -78,54 +94,134 @@ class PersonsLocationGenerator:
         lower_top_x = center_x
         lower_top_y = extra + center_y - triangle_height // 2
 
-        for i in range(n_rows):
-            for j in range(n_cols):
-                # Check upper triangle
-                if (j - upper_left_x) * (upper_bottom_y - upper_left_y) - \
-                        (i - upper_left_y) * (upper_bottom_x - upper_left_x) >= 0 and \
-                        (j - upper_right_x) * (upper_bottom_y - upper_right_y) - \
-                        (i - upper_right_y) * (upper_bottom_x - upper_right_x) <= 0 and \
-                        (j - upper_left_x) * (upper_right_y - upper_left_y) - \
-                        (i - upper_left_y) * (upper_right_x - upper_left_x) <= 0:
-                    locations.add((i,j))
-                # Check lower triangle
-                if (j - lower_left_x) * (lower_top_y - lower_left_y) - \
-                        (i - lower_left_y) * (lower_top_x - lower_left_x) <= 0 and \
-                        (j - lower_right_x) * (lower_top_y - lower_right_y) - \
-                        (i - lower_right_y) * (lower_top_x - lower_right_x) >= 0 and \
-                        (j - lower_left_x) * (lower_right_y - lower_left_y) - \
-                        (i - lower_left_y) * (lower_right_x - lower_left_x) >= 0:
-                    locations.add((i,j))
-        return locations
+        # half-plane tests of both triangles, on the whole grid at once
+        upper_triangle = (
+            ((j - upper_left_x) * (upper_bottom_y - upper_left_y) -
+             (i - upper_left_y) * (upper_bottom_x - upper_left_x) >= 0) &
+            ((j - upper_right_x) * (upper_bottom_y - upper_right_y) -
+             (i - upper_right_y) * (upper_bottom_x - upper_right_x) <= 0) &
+            ((j - upper_left_x) * (upper_right_y - upper_left_y) -
+             (i - upper_left_y) * (upper_right_x - upper_left_x) <= 0)
+        )
+        lower_triangle = (
+            ((j - lower_left_x) * (lower_top_y - lower_left_y) -
+             (i - lower_left_y) * (lower_top_x - lower_left_x) <= 0) &
+            ((j - lower_right_x) * (lower_top_y - lower_right_y) -
+             (i - lower_right_y) * (lower_top_x - lower_right_x) >= 0) &
+            ((j - lower_left_x) * (lower_right_y - lower_left_y) -
+             (i - lower_left_y) * (lower_right_x - lower_left_x) >= 0)
+        )
+        return upper_triangle | lower_triangle
+
+    @staticmethod
+    def david_star_indices(n_person_cells=None, n_cols=None, n_rows=None):
+        return np.flatnonzero(PersonsLocationGenerator.david_star_mask(n_cols=n_cols, n_rows=n_rows))
+
+    def random_locations(self, n_person_cells=None, n_cols=None, n_rows=None, rng: np.random.Generator = None):
+        indices = self.random_indices(n_person_cells=n_person_cells, n_cols=n_cols, n_rows=n_rows, rng=rng)
+        return indices_to_locations(indices, n_cols)
+
+    @staticmethod
+    def lines_location(n_person_cells=None, n_cols=None, n_rows=None):
+        indices = PersonsLocationGenerator.lines_indices(n_person_cells=n_person_cells, n_cols=n_cols, n_rows=n_rows)
+        return indices_to_locations(indices, n_cols)
+
+    @staticmethod
+    def square_location(n_person_cells=None, n_cols=None, n_rows=None):
+        indices = PersonsLocationGenerator.square_indices(n_person_cells=n_person_cells, n_cols=n_cols, n_rows=n_rows)
+        return indices_to_locations(indices, n_cols)
+
     @staticmethod
-    def doubt_sample_easy_believer_next_to_not(persons_location):
-        doubt_level_locations_dict = {}
-        for i, location in enumerate(persons_location):
-            if i % 2 == 0:
-                doubt_level_locations_dict[location] = DoubtLevel.S1
-            else:
-                doubt_level_locations_dict[location] = DoubtLevel.S4
-        return doubt_level_locations_dict
+    def frame_location(n_person_cells=None, n_cols=None, n_rows=None):
+        indices = PersonsLocationGenerator.frame_indices(n_person_cells=n_person_cells, n_cols=n_cols, n_rows=n_rows)
+        return indices_to_locations(indices, n_cols)
 
     @staticmethod
-    def doubt_sample_easy_believer_next_to_k_hard_believers(persons_location,k=3):
-        doubt_level_locations_dict = {}
-        for i, location in enumerate(persons_location):
-            if i % k == 0:
-                doubt_level_locations_dict[location] = DoubtLevel.S1
-            else:
-                doubt_level_locations_dict[location] = DoubtLevel.S3
-        return doubt_level_locations_dict
+    def david_star_locations(n_person_cells=None, n_cols=None, n_rows=None):
+        indices = PersonsLocationGenerator.david_star_indices(n_person_cells=n_person_cells, n_cols=n_cols,
+                                                              n_rows=n_rows)
+        return indices_to_locations(indices, n_cols)
+
+    # the doubt_levels_* rules return an int8 array of DoubtLevel values aligned with the sorted persons indices,
+    # the doubt_sample_* rules return the same assignment as a {location: DoubtLevel} dict
 
     @staticmethod
-    def doubt_sample_line_between_easy_believer_hard_believers(persons_location, easy_doubt: List, hard_doubt: List):
-        doubt_level_locations_dict = {}
-        for i, location in enumerate(persons_location):
-            if location[0] % 4 == 0:
-                doubt_level_locations_dict[location] = random.choice(easy_doubt)
-            else:
-                doubt_level_locations_dict[location] = random.choice(hard_doubt)
-        return doubt_level_locations_dict
+    def doubt_level_counts(n_persons: int, persons_distribution) -> Dict[DoubtLevel, int]:
+        # the number of persons of every doubt level. the shares are rounded down and the remainder persons go,
+        # one each, to the doubt levels with the largest rounded off fractions (ties by doubt level order)
+        total_share = sum(persons_distribution[doubt_level] for doubt_level in DoubtLevel)
+        exact_counts = {
+            doubt_level: n_persons * persons_distribution[doubt_level] / total_share for doubt_level in DoubtLevel
+        }
+        n_doubt_level_dict = {doubt_level: int(exact_counts[doubt_level]) for doubt_level in DoubtLevel}
+        n_remainder = n_persons - sum(n_doubt_level_dict.values())
+        by_fraction = sorted(DoubtLevel, key=lambda level: exact_counts[level] - n_doubt_level_dict[level], reverse=True)
+        for doubt_level in by_fraction[:n_remainder]:
+            n_doubt_level_dict[doubt_level] += 1
+        return n_doubt_level_dict
+
+    def doubt_levels_random(self, n_persons: int, persons_distribution, rng: np.random.Generator = None):
+        # one permutation of the exact doubt level counts, O(n_persons)
+        rng = self._get_rng(rng)
+        n_doubt_level_dict = PersonsLocationGenerator.doubt_level_counts(n_persons, persons_distribution)
+        doubt_levels = np.repeat(
+            np.array([doubt_level.value for doubt_level in DoubtLevel], dtype=np.int8),
+            [n_doubt_level_dict[doubt_level] for doubt_level in DoubtLevel],
+        )
+        return rng.permutation(doubt_levels)
+
+    def doubt_levels_easy_believer_next_to_not(self, n_persons: int, rng: np.random.Generator = None):
+        # every second person, in a random order, is an easy believer and the others don't believe
+        order = self._get_rng(rng).permutation(n_persons)
+        return np.where(order % 2 == 0, DoubtLevel.S1.value, DoubtLevel.S4.value).astype(np.int8)
+
+    def doubt_levels_easy_believer_next_to_k_hard_believers(self, n_persons: int, k=3, rng: np.random.Generator = None):
+        # every k-th person, in a random order, is an easy believer and the others are hard believers
+        order = self._get_rng(rng).permutation(n_persons)
+        return np.where(order % k == 0, DoubtLevel.S1.value, DoubtLevel.S3.value).astype(np.int8)
+
+    def doubt_levels_line_between_easy_believer_hard_believers(self, persons_indices, n_cols: int, easy_doubt: List,
+                                                               hard_doubt: List, rng: np.random.Generator = None):
+        rng = self._get_rng(rng)
+        easy_values = np.array([doubt_level.value for doubt_level in easy_doubt], dtype=np.int8)
+        hard_values = np.array([doubt_level.value for doubt_level in hard_doubt], dtype=np.int8)
+        n_persons = len(persons_indices)
+        return np.where(
+            (np.asarray(persons_indices) // n_cols) % 4 == 0,
+            rng.choice(easy_values, size=n_persons),
+            rng.choice(hard_values, size=n_persons),
+        ).astype(np.int8)
+
+    @staticmethod
+    def _to_doubt_level_locations_dict(sorted_locations, doubt_levels):
+        return {location: DoubtLevel(value) for location, value in zip(sorted_locations, doubt_levels.tolist())}
+
+    def doubt_sample_easy_believer_next_to_not(self, persons_location, rng: np.random.Generator = None):
+        sorted_locations = sorted(persons_location)
+        return PersonsLocationGenerator._to_doubt_level_locations_dict(
+            sorted_locations,
+            self.doubt_levels_easy_believer_next_to_not(n_persons=len(sorted_locations), rng=rng),
+        )
+
+    def doubt_sample_easy_believer_next_to_k_hard_believers(self, persons_location, k=3,
+                                                             rng: np.random.Generator = None):
+        sorted_locations = sorted(persons_location)
+        return PersonsLocationGenerator._to_doubt_level_locations_dict(
+            sorted_locations,
+            self.doubt_levels_easy_believer_next_to_k_hard_believers(n_persons=len(sorted_locations), k=k, rng=rng),
+        )
+
+    def doubt_sample_line_between_easy_believer_hard_believers(self, persons_location, easy_doubt: List,
+                                                               hard_doubt: List, rng: np.random.Generator = None):
+        sorted_locations = sorted(persons_location)
+        # the rule only looks at the row, so any n_cols works for the flat indices
+        return PersonsLocationGenerator._to_doubt_level_locations_dict(
+            sorted_locations,
+            self.doubt_levels_line_between_easy_believer_hard_believers(
+                persons_indices=[row for row, col in sorted_locations], n_cols=1,
+                easy_doubt=easy_doubt, hard_doubt=hard_doubt, rng=rng,
+            ),
+        )
 
     @staticmethod
     def merge_doubt_dict(first, second):
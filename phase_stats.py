@@ -0,0 +1,85 @@
+import time
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+
+# the phases of a spread_rumor turn, in order, and the counts recorded for every turn
+PHASES = ("find_spreaders", "count_hits", "reset_spreaders", "draw_beliefs", "next_turn")
+COUNTS = ("n_spreaders", "n_hits", "n_listeners", "n_believers")
+
+
+class PhaseStats:
+    """
+    Per turn wall time of every spread_rumor phase and the turn's counts, opt-in: set it as an EnvMap's
+    phase_stats (or pass it to VectorizedEngine.spread_rumor) and every turn is recorded.
+    callback, if given, is called after every turn with the turn's {phase: seconds} and {count: value}
+    """
+
+    def __init__(self, callback: Callable[[Dict[str, float], Dict[str, int]], None] = None):
+        self.callback = callback
+        self.seconds: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+        self.counts: Dict[str, List[int]] = {name: [] for name in COUNTS}
+        self._turn_seconds: Dict[str, float] = {}
+        self._phase_start = None
+
+    @property
+    def n_turns(self) -> int:
+        return len(self.counts[COUNTS[0]])
+
+    def start_turn(self) -> None:
+        self._turn_seconds = {}
+        self._phase_start = time.perf_counter()
+
+    def end_phase(self, phase: str) -> None:
+        now = time.perf_counter()
+        self._turn_seconds[phase] = now - self._phase_start
+        self._phase_start = now
+
+    def end_turn(self, **counts) -> None:
+        for phase in PHASES:
+            self.seconds[phase].append(self._turn_seconds.get(phase, 0.0))
+        for name in COUNTS:
+            self.counts[name].append(int(counts[name]))
+        if self.callback is not None:
+            self.callback(self._turn_seconds, counts)
+
+    def seconds_array(self) -> np.ndarray:
+        # (n_turns, len(PHASES)) wall times
+        return np.array([self.seconds[phase] for phase in PHASES], dtype=float).T
+
+    def counts_array(self) -> np.ndarray:
+        # (n_turns, len(COUNTS)) counts
+        return np.array([self.counts[name] for name in COUNTS], dtype=np.int64).T
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        # total and mean per turn seconds and share of the turn time of every phase, mean of every count
+        totals = {phase: float(np.sum(self.seconds[phase])) for phase in PHASES}
+        total_seconds = sum(totals.values())
+        n_turns = max(self.n_turns, 1)
+        summary = {
+            phase: {
+                "total_seconds": totals[phase],
+                "mean_seconds": totals[phase] / n_turns,
+                "share": totals[phase] / total_seconds if total_seconds else 0.0,
+            }
+            for phase in PHASES
+        }
+        summary["counts"] = {name: float(np.sum(self.counts[name])) / n_turns for name in COUNTS}
+        return summary
+
+    @classmethod
+    def merge(cls, all_stats: Iterable["PhaseStats"]) -> "PhaseStats":
+        # the turns of all the given stats (e.g. of the replicas of a sweep) in one PhaseStats
+        merged = cls()
+        for stats in all_stats:
+            for phase in PHASES:
+                merged.seconds[phase].extend(stats.seconds[phase])
+            for name in COUNTS:
+                merged.counts[name].extend(stats.counts[name])
+        return merged
+
+    def __getstate__(self):
+        # the callback stays in the process that set it, the stats travel back from the sweep workers
+        state = dict(self.__dict__)
+        state["callback"] = None
+        return state
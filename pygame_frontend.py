@@ -8,26 +8,90 @@ from easygui import multenterbox
 import matplotlib.pyplot as plt
 from ex1 import wrap_all_around_policy, all_around_policy, LocationShape, DistributionRule
 from ex1 import L, P, PERSONS_DISTRIBUTION, MATRIX_SIZE, DoubtLevel, EnvMap
+from frame_colours import PALETTE, DENSITY_PALETTE
+from history_recorder import HistoryRecorder
+from simulation_worker import SimulationWorker, DEFAULT_TURNS_PER_SECOND
+from viewport import Viewport
 
 NUMBER_OF_PARAMETERS = 7
 DEFAULT_NUMBER_OF_EPISODES = 150
+FRAMES_PER_SECOND = 60
 
 Graph = typing.NamedTuple("Graph", [("graph", typing.List[int]), ("description", str), ("color", str)])
 
+# squares per side of the blocks the dirty rects are made of
+DIRTY_BLOCK_SIZE = 32
+
+
+class GridRenderer:
+    """
+    Draws a grid of colour indices as a pixel buffer: one 8 bit pixel per grid cell holding its colour index
+    (the surface's palette maps it to the palette's colours, so no RGB array is built), pushed with
+    pygame.surfarray. Only the blocks of cells that changed since the previous frame are blitted, draw returns
+    their rects for pygame.display.update
+    """
+
+    def __init__(self, n_rows: int, n_cols: int, block_size: int = DIRTY_BLOCK_SIZE, palette: np.ndarray = PALETTE):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.block_size = block_size
+        # surfarray works in (x, y) = (col, row) order
+        self._pixels = pygame.Surface((n_cols, n_rows), depth=8)
+        self._pixels.set_palette([tuple(colour) for colour in palette.tolist()])
+        self._previous_colour_indices: np.ndarray = None
+
+    def _dirty_blocks(self, colour_indices: np.ndarray) -> np.ndarray:
+        # (block row, block col) of the blocks with a cell that changed since the previous frame
+        if self._previous_colour_indices is None:
+            changed = np.ones(colour_indices.shape, dtype=bool)
+        else:
+            changed = colour_indices != self._previous_colour_indices
+        changed = np.logical_or.reduceat(changed, np.arange(0, self.n_rows, self.block_size), axis=0)
+        changed = np.logical_or.reduceat(changed, np.arange(0, self.n_cols, self.block_size), axis=1)
+        return np.argwhere(changed)
+
+    def draw(self, surface: pygame.Surface, colour_indices: np.ndarray, position=(0, 0)) -> List[pygame.Rect]:
+        dirty_blocks = self._dirty_blocks(colour_indices)
+        first_frame = self._previous_colour_indices is None
+        self._previous_colour_indices = colour_indices
+        if len(dirty_blocks) == 0:
+            return []
+        pygame.surfarray.blit_array(self._pixels, colour_indices.T)
+
+        if first_frame or len(dirty_blocks) * self.block_size ** 2 >= colour_indices.size:
+            # (nearly) everything changed, one blit of the whole grid
+            rects = [pygame.Rect(0, 0, self.n_cols, self.n_rows)]
+        else:
+            rects = [
+                pygame.Rect(
+                    block_col * self.block_size, block_row * self.block_size, self.block_size, self.block_size
+                ).clip(0, 0, self.n_cols, self.n_rows)
+                for block_row, block_col in dirty_blocks.tolist()
+            ]
+        dirty_rects = []
+        for rect in rects:
+            surface.blit(self._pixels, rect.move(position), area=rect)
+            dirty_rects.append(rect.move(position))
+        return dirty_rects
+
 
 class Board:
     def __init__(self, board_size, tile_size, env_map: EnvMap):
         self.board_size = board_size
         self.tile_size = tile_size
         self.env_map = env_map
-        # Define the colors
-        self.BLACK = (0, 0, 0)
-        self.WHITE = (255, 255, 255)
-        self.GRAY = (128, 128, 128)
-        self.RED = (255, 0, 0)
-
-        # Create the board
-        self.board = [[None] * self.env_map._n_rows for _ in range(self.env_map._n_cols)]
+        # the board area shows the part of the map in the viewport, a screen pixel is a square (zoomed in by
+        # tile_size when the map fits) or a block of squares. a frame costs the screen size plus the turn's new
+        # hearers, only a change of the zoom level recounts the whole map's blocks (see Viewport)
+        self.viewport = Viewport(
+            n_rows=env_map._n_rows,
+            n_cols=env_map._n_cols,
+            width=board_size * tile_size,
+            height=board_size * tile_size,
+            pixels_per_cell=tile_size,
+        )
+        # a pixel per screen pixel, the viewport zooms and draws the grid lines between big squares
+        self.renderer = GridRenderer(n_rows=self.viewport.height, n_cols=self.viewport.width, palette=DENSITY_PALETTE)
         # Initialize Pygame
         pygame.init()
 
@@ -40,27 +104,45 @@ class Board:
         # Set the window caption
         pygame.display.set_caption("Board")
 
-    def update_board(self):
-        for i in range(self.env_map._n_rows):
-            for j in range(self.env_map._n_cols):
-                if self.env_map._matrix[i][j].did_hear_rumour_sometime():
-                    self.board[i][j] = self.BLACK
-                else:
-                    self.board[i][j] = self.WHITE
-        return board
-
-    @staticmethod
-    def handle_quit_and_escape_events():
+    def handle_events(self, worker: SimulationWorker):
+        # quit / escape stop the run, space pauses, right arrow steps a turn while paused,
+        # f toggles running as fast as possible. the mouse wheel and +/- zoom, dragging and w/a/s/d pan
         status = True
+        pan_step = min(self.viewport.width, self.viewport.height) // 8
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 status = False
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     status = False
+                elif event.key == pygame.K_SPACE:
+                    worker.toggle_pause()
+                elif event.key == pygame.K_RIGHT:
+                    worker.step()
+                elif event.key == pygame.K_f:
+                    worker.toggle_run_as_fast_as_possible()
+                elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                    self.viewport.zoom(zoom_in=True)
+                elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                    self.viewport.zoom(zoom_in=False)
+                elif event.key == pygame.K_w:
+                    self.viewport.pan(0, pan_step)
+                elif event.key == pygame.K_s:
+                    self.viewport.pan(0, -pan_step)
+                elif event.key == pygame.K_a:
+                    self.viewport.pan(pan_step, 0)
+                elif event.key == pygame.K_d:
+                    self.viewport.pan(-pan_step, 0)
+            elif event.type == pygame.MOUSEWHEEL and event.y != 0:
+                x, y = pygame.mouse.get_pos()
+                self.viewport.zoom(zoom_in=event.y > 0, x=x, y=y)
+            elif event.type == pygame.MOUSEMOTION and event.buttons[0]:
+                self.viewport.pan(*event.rel)
         return status
 
-    def run(self, number_of_episodes: int = 100):
+    def run(self, number_of_episodes: int = 100, stop_when_quiescent: bool = True, recorder: HistoryRecorder = None,
+            turns_per_second: float = DEFAULT_TURNS_PER_SECOND):
+        # with a recorder the state of every episode is recorded for replay, see history_recorder.HistoryReader
         # Set the flag to continue the game
         running = True
         surface = pygame.display.set_mode((
@@ -71,34 +153,39 @@ class Board:
         # Draw background
         background_image = pygame.image.load('background.jpg')
         surface.blit(background_image, (0, 0))
-        believers_percentage = []
-        running = True
-        # Loop until the user quits
-        for i in range(number_of_episodes):
-            if not running:
-                break
-
-            # Draw the board
-            print(f"turn {i}==================")
-            self.env_map.spread_rumor()
-            self.update_board()
-            # Draw the board
-            for i in range(self.board_size):
-                for j in range(0, self.board_size):
-                    tile_rect = pygame.Rect(j * self.tile_size, i * self.tile_size, self.tile_size, self.tile_size)
-                    pygame.draw.rect(surface, self.board[i][j], tile_rect, 0)
-                    pygame.draw.rect(surface, self.GRAY, tile_rect, 1)
-
-            running = self.handle_quit_and_escape_events()
-            # Update the display
-            pygame.display.update()
-            self.clock.tick(100)
-            believers_percentage.append(env_map.calculate_percentage_of_believers())
-
-        self.clock.tick(100)
+        pygame.display.update()
+
+        # the episodes run in a background thread, this loop only draws the newest frame and handles the events,
+        # so a slow turn doesn't freeze the window and drawing doesn't slow the simulation down
+        worker = SimulationWorker(
+            env_map=self.env_map,
+            n_turns=number_of_episodes,
+            colour_indices=self.viewport.colour_indices,
+            stop_when_quiescent=stop_when_quiescent,
+            recorder=recorder,
+            turns_per_second=turns_per_second,
+        )
+        worker.start()
+        requested_view = self.viewport.view
+        # Loop until the user quits or all the episodes were drawn
+        while running and not worker.finished:
+            running = self.handle_events(worker)
+            frame = worker.get_newest_frame()
+            if frame is not None:
+                # Draw the board, update the display only where the board changed
+                pygame.display.update(self.renderer.draw(surface, frame.colour_indices))
+            elif self.viewport.view != requested_view and worker.paused:
+                # zoomed / panned while paused, the map is only read in the worker thread (a stepped turn may be
+                # running), so the worker renders the new view between turns. it does so with the next turn otherwise
+                requested_view = self.viewport.view
+                worker.request_frame()
+            self.clock.tick(FRAMES_PER_SECOND)
+        worker.stop()
+        worker.join()
+
         # Quit Pygame
         pygame.quit()
-        return believers_percentage
+        return worker.believers_percentage
 
 
 def input_check(parameters: List[str]):
@@ -163,7 +250,8 @@ def extract_parameters(parameters: List[str]):
     return int(n_episodes), float(p), float(d_s1), float(d_s2), float(d_s3), float(d_s4), int(n_cooldown)
 
 
-def plot_experiment(graphs: typing.List[Graph], times=None, shape=None, dist=None, p=P):
+def plot_experiment(graphs: typing.List[Graph], times=None, shape=None, dist=None, p=P, output_path=None):
+    # shows the plot, or with output_path saves it there instead (no display needed)
     for graph in graphs:
         size = len(graph.graph)
         plt.plot(np.arange(0, size), graph.graph, label=graph.description, color=graph.color, marker=".", markersize=5)
@@ -171,6 +259,10 @@ def plot_experiment(graphs: typing.List[Graph], times=None, shape=None, dist=Non
     plt.legend()
     plt.title(f"repeated experiment :={times} P:={p} shape:={shape} dist={dist}", fontsize=10)
     plt.suptitle("Rumors statistics graph", fontsize=20)
+    if output_path is not None:
+        plt.savefig(output_path)
+        plt.close()
+        return
     plt.show()
 
 
@@ -0,0 +1,153 @@
+import statistics
+from typing import Sequence, Tuple
+
+import numpy as np
+
+# per turn statistics of the replicas of an experiment, folded in as every replica (or batch of replicas) finishes,
+# so the memory is O(n_turns) whatever the number of replicas
+
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+DEFAULT_N_BINS = 1000
+DEFAULT_CONFIDENCE_LEVEL = 0.95
+# the growth after a value this close to zero is not defined
+MIN_GROWTH_BASE = 1e-12
+
+
+def growth_percentages(series, min_base: float = MIN_GROWTH_BASE) -> np.ndarray:
+    # percentage change of every turn from the previous turn, along the last axis (one replica or one per row).
+    # nan where the previous value is (close to) zero
+    series = np.asarray(series, dtype=float)
+    previous = series[..., :-1]
+    growth = np.full(previous.shape, np.nan)
+    np.divide((series[..., 1:] - previous) * 100, previous, out=growth, where=np.abs(previous) > min_base)
+    return growth
+
+
+class RunningMoments:
+    """
+    Per turn count, mean and variance of a stream of series. Batches of series are merged in with Chan's
+    parallel form of Welford's update, vectorized over the turns. nan values are skipped
+    """
+
+    def __init__(self, n_turns: int):
+        self.count = np.zeros(n_turns, dtype=np.int64)
+        self.mean = np.zeros(n_turns)
+        self._m2 = np.zeros(n_turns)
+
+    def _merge(self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray) -> None:
+        total = self.count + count
+        delta = mean - self.mean
+        weight = np.divide(count, total, out=np.zeros(len(total)), where=total > 0)
+        self.mean = self.mean + delta * weight
+        self._m2 = self._m2 + m2 + delta ** 2 * self.count * weight
+        self.count = total
+
+    def add(self, series) -> None:
+        # series is one series of n_turns values or an (n_series, n_turns) array
+        values = np.atleast_2d(np.asarray(series, dtype=float))
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+        mean = np.divide(
+            np.where(valid, values, 0).sum(axis=0), count, out=np.zeros(values.shape[1]), where=count > 0
+        )
+        m2 = (np.where(valid, values - mean, 0) ** 2).sum(axis=0)
+        self._merge(count, mean, m2)
+
+    def merge(self, other: "RunningMoments") -> None:
+        self._merge(other.count, other.mean, other._m2)
+
+    def variance(self, ddof: int = 1) -> np.ndarray:
+        return np.divide(self._m2, self.count - ddof, out=np.full(len(self.count), np.nan), where=self.count > ddof)
+
+    def std(self, ddof: int = 1) -> np.ndarray:
+        return np.sqrt(self.variance(ddof=ddof))
+
+    def confidence_interval(self, level: float = DEFAULT_CONFIDENCE_LEVEL) -> Tuple[np.ndarray, np.ndarray]:
+        # normal approximation of the interval of the mean, nan for the turns with less than 2 values
+        z = statistics.NormalDist().inv_cdf((1 + level) / 2)
+        margin = z * self.std() / np.sqrt(np.maximum(self.count, 1))
+        return self.mean - margin, self.mean + margin
+
+
+class HistogramQuantiles:
+    """
+    Quantile sketch of a stream of series: a fixed width histogram per turn over [low, high] (values outside are
+    clipped into the edge bins), the quantiles are accurate to a bin width
+    """
+
+    def __init__(self, n_turns: int, low: float = 0.0, high: float = 1.0, n_bins: int = DEFAULT_N_BINS):
+        if high <= low:
+            raise Exception(f"Invalid histogram range [{low}, {high}], high should be above low")
+        self.low = low
+        self.high = high
+        self.n_bins = n_bins
+        self.counts = np.zeros((n_turns, n_bins), dtype=np.int64)
+
+    def add(self, series) -> None:
+        values = np.atleast_2d(np.asarray(series, dtype=float))
+        valid = ~np.isnan(values)
+        bins = np.clip(((values[valid] - self.low) / (self.high - self.low) * self.n_bins).astype(np.int64),
+                       0, self.n_bins - 1)
+        turns = np.broadcast_to(np.arange(values.shape[1]), values.shape)[valid]
+        self.counts += np.bincount(turns * self.n_bins + bins, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other: "HistogramQuantiles") -> None:
+        self.counts += other.counts
+
+    def quantiles(self, quantiles: Sequence[float] = DEFAULT_QUANTILES) -> np.ndarray:
+        # (len(quantiles), n_turns) bin centers, nan for the turns without values
+        cumulative = np.cumsum(self.counts, axis=1)
+        total = cumulative[:, -1]
+        targets = np.asarray(quantiles, dtype=float)[:, None, None] * total[None, :, None]
+        bins = np.minimum((cumulative[None] < targets).sum(axis=-1), self.n_bins - 1)
+        values = self.low + (bins + 0.5) * (self.high - self.low) / self.n_bins
+        values[:, total == 0] = np.nan
+        return values
+
+
+class ReplicaStatsAggregator:
+    """
+    Mean, confidence interval and quantiles per turn of the replicas' series (e.g. believers percentage), and the
+    mean and confidence interval of their growth, without keeping the series. add every replica (or batch of
+    replicas) as it finishes, merge combines aggregators of the same experiment (e.g. from different workers)
+    """
+
+    def __init__(self, n_turns: int, low: float = 0.0, high: float = 1.0, n_bins: int = DEFAULT_N_BINS):
+        self.n_turns = n_turns
+        self.values = RunningMoments(n_turns)
+        self.growth = RunningMoments(max(n_turns - 1, 0))
+        self.sketch = HistogramQuantiles(n_turns, low=low, high=high, n_bins=n_bins)
+        self.n_replicas = 0
+
+    def add(self, series) -> None:
+        series = np.atleast_2d(np.asarray(series, dtype=float))
+        if series.shape[1] != self.n_turns:
+            raise Exception(f"Invalid series length {series.shape[1]}, it should be {self.n_turns}")
+        self.values.add(series)
+        self.growth.add(growth_percentages(series))
+        self.sketch.add(series)
+        self.n_replicas += len(series)
+
+    def merge(self, other: "ReplicaStatsAggregator") -> None:
+        self.values.merge(other.values)
+        self.growth.merge(other.growth)
+        self.sketch.merge(other.sketch)
+        self.n_replicas += other.n_replicas
+
+    def mean(self) -> np.ndarray:
+        return self.values.mean
+
+    def std(self) -> np.ndarray:
+        return self.values.std()
+
+    def confidence_interval(self, level: float = DEFAULT_CONFIDENCE_LEVEL) -> Tuple[np.ndarray, np.ndarray]:
+        return self.values.confidence_interval(level=level)
+
+    def quantiles(self, quantiles: Sequence[float] = DEFAULT_QUANTILES) -> np.ndarray:
+        return self.sketch.quantiles(quantiles)
+
+    def growth_mean(self) -> np.ndarray:
+        return self.growth.mean
+
+    def growth_confidence_interval(self, level: float = DEFAULT_CONFIDENCE_LEVEL) -> Tuple[np.ndarray, np.ndarray]:
+        return self.growth.confidence_interval(level=level)
@@ -1,64 +1,177 @@
 import functools
-from typing import Callable
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from typing import Callable, Dict, List
 
 from ex1 import EnvMap, all_around_policy, four_directions_policy, wrap_all_around_policy, LocationShape, \
-    DistributionRule
+    DistributionRule, EngineType
 from ex1 import EnvMap, MATRIX_SIZE, P, PERSONS_DISTRIBUTION
 import matplotlib.pyplot as plt
 import numpy as np
 import typing
 
+from events import EventBus
+from metrics_writer import MetricsWriter
+from phase_stats import PhaseStats
+from replica_stats import ReplicaStatsAggregator, growth_percentages
+from vectorized_engine import VectorizedEngine
+
+N_TURNS = 150
+
 Graph = typing.NamedTuple("Graph", [("graph", typing.List[int]), ("description", str), ("color", str)])
 
 
 def calc_spread_rate(env_map: EnvMap):
-    count = 0
-    for i in range(env_map._n_rows):
-        for j in range(env_map._n_cols):
-            if env_map._matrix[i][j].did_hear_rumour_sometime():
-                count += 1
-    return count / len(env_map.persons_location)
+    return env_map.calculate_percentage_of_believers()
+
+
+def replica_rngs(times, seed=None) -> List[np.random.Generator]:
+    # an independent generator per replica, spawned from one seed, so replica i of a run can be
+    # replayed alone (and gives the same result run one by one, batched or streamed) from the same seed
+    return [np.random.default_rng(seed_sequence) for seed_sequence in np.random.SeedSequence(seed).spawn(times)]
 
 
-def run_experiment_multiple_times(env_map_creator: Callable[...,EnvMap], times):
+def sweep_replica_rng(seed, config_index, replica) -> np.random.Generator:
+    # the generator of a replica of a config in run_sweep, create_env_map(**config, rng=...) with it replays the replica
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(config_index, replica)))
+
+
+def run_experiment_multiple_times(env_map_creator: Callable[...,EnvMap], times, seed=None,
+                                  phase_stats: PhaseStats = None, events: EventBus = None):
+    # phase_stats, if given, records the spread_rumor phases of the turns of all the replicas,
+    # events, if given, gets the events of all the replicas (env_map_creator has to take an events argument)
     raw_stats = []
-    for t in range(times):
-        believers = []
-        env_map = env_map_creator()
-        for i in range(150):
-            print(f"turn {i}==================")
-            env_map.spread_rumor()
-            believers.append(env_map.calculate_percentage_of_believers())
-        raw_stats.append(believers)
+    creator_kwargs = {} if events is None else {"events": events}
+    for rng in replica_rngs(times, seed=seed):
+        env_map = env_map_creator(rng=rng, **creator_kwargs)
+        env_map.phase_stats = phase_stats
+        raw_stats.append(env_map.run(N_TURNS))
     return raw_stats
 
 
+def run_experiment_batched(env_map_creator: Callable[..., EnvMap], times, n_turns=N_TURNS, seed=None,
+                           phase_stats: PhaseStats = None) -> np.ndarray:
+    # all the replicas are stacked into one vectorized engine and advanced together,
+    # returns the believers percentage per replica per turn as a (times, n_turns) array.
+    # stops once every replica is quiescent, the remaining turns keep the final values.
+    # phase_stats, if given, records the phases of the ensemble's turns (counts summed over the replicas)
+    return _run_ensemble(env_map_creator, replica_rngs(times, seed=seed), n_turns=n_turns, phase_stats=phase_stats)
+
+
+def _run_ensemble(env_map_creator: Callable[..., EnvMap], rngs: List[np.random.Generator], n_turns,
+                  phase_stats: PhaseStats = None) -> np.ndarray:
+    times = len(rngs)
+    env_maps = [env_map_creator(engine_type=EngineType.Vectorized, rng=rng) for rng in rngs]
+    ensemble = VectorizedEngine.stack([env_map.get_vectorized_engine() for env_map in env_maps])
+    n_persons = np.array([env_map.n_persons for env_map in env_maps])
+    believers = np.empty((times, n_turns))
+    for i in range(n_turns):
+        ensemble.spread_rumor(phase_stats=phase_stats)
+        believers[:, i] = ensemble.count_heard_rumour_sometime_per_replica() / n_persons
+        if ensemble.is_quiescent():
+            believers[:, i + 1:] = believers[:, i:i + 1]
+            break
+    return believers
+
+
+def run_experiment_aggregated(env_map_creator: Callable[..., EnvMap], times, n_turns=N_TURNS, batch_size=100,
+                              seed=None) -> ReplicaStatsAggregator:
+    # like run_experiment_batched, but every batch of batch_size replicas is folded into the per turn statistics
+    # as soon as it finishes, so only one batch of series is ever in memory
+    rngs = replica_rngs(times, seed=seed)
+    aggregator = ReplicaStatsAggregator(n_turns)
+    for first_replica in range(0, times, batch_size):
+        aggregator.add(_run_ensemble(env_map_creator, rngs[first_replica:first_replica + batch_size], n_turns=n_turns))
+    return aggregator
+
+
+def run_experiment_streaming(env_map_creator: Callable[..., EnvMap], times, metrics_writer: MetricsWriter,
+                             n_turns=N_TURNS, batch_size=100, seed=None, phase_stats: PhaseStats = None) -> None:
+    # like run_experiment_batched, but every turn's metrics of every replica go straight to the metrics writer
+    # and nothing is kept in memory, the replicas run in batches of batch_size
+    rngs = replica_rngs(times, seed=seed)
+    for first_replica in range(0, times, batch_size):
+        n_replicas = min(batch_size, times - first_replica)
+        env_maps = [
+            env_map_creator(engine_type=EngineType.Vectorized, rng=rng)
+            for rng in rngs[first_replica:first_replica + n_replicas]
+        ]
+        ensemble = VectorizedEngine.stack([env_map.get_vectorized_engine() for env_map in env_maps])
+        n_persons = np.array([env_map.n_persons for env_map in env_maps])
+        replicas = np.arange(first_replica, first_replica + n_replicas)
+        for i in range(n_turns):
+            # once all the replicas are quiescent the metrics stay the same, so there is nothing to step
+            if not ensemble.is_quiescent():
+                ensemble.spread_rumor(phase_stats=phase_stats)
+            metrics_writer.write(
+                replica=replicas,
+                # the state after turn i + 1, like EnvMap.turn
+                turn=i + 1,
+                believers_percentage=ensemble.count_heard_rumour_sometime_per_replica() / n_persons,
+                n_spreaders=ensemble.n_heard_rumour_last_turn,
+                n_in_cooldown=ensemble.n_in_cooldown,
+                n_heard_per_doubt_level=ensemble.n_heard_rumour_sometime_per_doubt_level[:, 1:],
+            )
+    metrics_writer.flush()
+
+
+def parameter_grid(**parameters) -> List[Dict]:
+    # every combination of the given create_env_map parameter values, e.g. cool_down=[2, 4], shape=[...]
+    names = list(parameters)
+    return [dict(zip(names, values)) for values in product(*parameters.values())]
+
+
+def _run_sweep_task(task):
+    config, seed, config_index, replica, n_turns, collect_phase_stats = task
+    # every task gets its own stream, the location sampling and the engines all draw from it
+    env_map = create_env_map(**config, rng=sweep_replica_rng(seed, config_index=config_index, replica=replica))
+    if collect_phase_stats:
+        env_map.phase_stats = PhaseStats()
+    return np.array(env_map.run(n_turns)), env_map.phase_stats
+
+
+def run_sweep(configs: List[Dict], times, n_workers=None, chunksize=None, seed=None,
+              n_turns=N_TURNS, phase_stats: List[PhaseStats] = None) -> List[np.ndarray]:
+    # runs `times` replicas of every create_env_map config on a process pool,
+    # returns a (times, n_turns) believers percentage array per config, in the configs order.
+    # replica r of config c can be replayed alone with sweep_replica_rng(seed, c, r).
+    # if a phase_stats list is given, the spread_rumor phases of the replicas are recorded in the workers and
+    # one PhaseStats per config, of all its replicas, is appended to it
+    n_workers = n_workers if n_workers is not None else os.cpu_count()
+    # without a seed a random one is picked, so all the tasks still derive from the same one
+    seed = seed if seed is not None else np.random.SeedSequence().entropy
+    tasks = [
+        (config, seed, config_index, replica, n_turns, phase_stats is not None)
+        for config_index, config in enumerate(configs)
+        for replica in range(times)
+    ]
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (n_workers * 4))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(_run_sweep_task, tasks, chunksize=chunksize))
+    if phase_stats is not None:
+        phase_stats.extend(
+            PhaseStats.merge(stats for _, stats in results[i * times:(i + 1) * times]) for i in range(len(configs))
+        )
+    return [np.array([series for series, _ in results[i * times:(i + 1) * times]]) for i in range(len(configs))]
+
+
 def calc_growth(population):
-    growth = []
-    for pop in range(1, len(population)):
-        numbers = (population[pop] - population[pop - 1]) / population[pop - 1] * 100
-        growth.append(numbers)
-    return growth
+    # percentage growth per turn, nan after a zero population
+    return growth_percentages(population)
 
 
 def calc_average_per_turn(raw_stats):
-    total_avgs = []
-    for turn_number in range(len(raw_stats[0])):
-        sum_for_turn = 0
-        for population in raw_stats:
-            sum_for_turn = sum_for_turn + population[turn_number]
-        total_avgs.append(sum_for_turn / len(raw_stats))
-    return total_avgs
+    return np.mean(np.asarray(raw_stats, dtype=float), axis=0)
 
 
 def raw_stats_to_growth(raw_stats):
-    growth = []
-    for population in raw_stats:
-        growth.append(calc_growth(population))
-    return growth
+    return growth_percentages(raw_stats)
 
 
-def plot_experiment(graphs: typing.List[Graph], times=None, shape=None, dist=None, p=P):
+def plot_experiment(graphs: typing.List[Graph], times=None, shape=None, dist=None, p=P, output_path=None):
+    # shows the plot, or with output_path saves it there instead (no display needed)
     for graph in graphs:
         size = len(graph.graph)
         plt.plot(np.arange(0, size), graph.graph, label=graph.description, color=graph.color, marker=".", markersize=5)
@@ -66,6 +179,10 @@ def plot_experiment(graphs: typing.List[Graph], times=None, shape=None, dist=Non
     plt.legend()
     plt.title(f"repeated experiment :={times} P:={p} shape:={shape} dist={dist}", fontsize=10)
     plt.suptitle("Rumors statistics graph", fontsize=20)
+    if output_path is not None:
+        plt.savefig(output_path)
+        plt.close()
+        return
     plt.show()
 
 
@@ -92,8 +209,8 @@ def main(env_map_creator: Callable[...,EnvMap],times=10) -> None:
     plot_experiment(avg_growth, label="average growth", times=times,cool_down=4,shape='square', dist='3 lines space',p=P)
 
 
-def create_env_map(cool_down,shape:LocationShape,distribution:DistributionRule):
-    print(f"cool down:{cool_down}")
+def create_env_map(cool_down,shape:LocationShape,distribution:DistributionRule,
+                   engine_type:EngineType=EngineType.Objects, rng=None, events: EventBus = None):
     return EnvMap(
         n_rows=MATRIX_SIZE,
         n_cols=MATRIX_SIZE,
@@ -102,26 +219,36 @@ def create_env_map(cool_down,shape:LocationShape,distribution:DistributionRule):
         cool_down_l=cool_down,
         policy=all_around_policy,
         location_shape=shape,
-        distribution_rule=distribution
+        distribution_rule=distribution,
+        engine_type=engine_type,
+        rng=rng,
+        events=events
     )
 
 def main_cooldown():
     TIMES = 30
-    env_cooldown_2 = functools.partial(create_env_map, cool_down=2)
-    env_cooldown_3 = functools.partial(create_env_map, cool_down=3)
-    env_cooldown_4 = functools.partial(create_env_map, cool_down=4)
-    env_cooldown_5 = functools.partial(create_env_map, cool_down=5)
-    env_cooldown_6 = functools.partial(create_env_map, cool_down=6)
-    env_cooldown_8 = functools.partial(create_env_map, cool_down=8)
-    env_cooldown_10 = functools.partial(create_env_map, cool_down=10)
-
-    raw_stats_cooldown_2 = run_experiment_multiple_times(env_cooldown_2, TIMES)
-    raw_stats_cooldown_3 = run_experiment_multiple_times(env_cooldown_3, TIMES)
-    raw_stats_cooldown_4 = run_experiment_multiple_times(env_cooldown_4, TIMES)
-    raw_stats_cooldown_5 = run_experiment_multiple_times(env_cooldown_5, TIMES)
-    raw_stats_cooldown_6 = run_experiment_multiple_times(env_cooldown_6, TIMES)
-    raw_stats_cooldown_8 = run_experiment_multiple_times(env_cooldown_8, TIMES)
-    raw_stats_cooldown_10 = run_experiment_multiple_times(env_cooldown_10, TIMES)
+    env_cooldown_2 = functools.partial(create_env_map, cool_down=2,
+                                       shape=LocationShape.Random, distribution=DistributionRule.Random)
+    env_cooldown_3 = functools.partial(create_env_map, cool_down=3,
+                                       shape=LocationShape.Random, distribution=DistributionRule.Random)
+    env_cooldown_4 = functools.partial(create_env_map, cool_down=4,
+                                       shape=LocationShape.Random, distribution=DistributionRule.Random)
+    env_cooldown_5 = functools.partial(create_env_map, cool_down=5,
+                                       shape=LocationShape.Random, distribution=DistributionRule.Random)
+    env_cooldown_6 = functools.partial(create_env_map, cool_down=6,
+                                       shape=LocationShape.Random, distribution=DistributionRule.Random)
+    env_cooldown_8 = functools.partial(create_env_map, cool_down=8,
+                                       shape=LocationShape.Random, distribution=DistributionRule.Random)
+    env_cooldown_10 = functools.partial(create_env_map, cool_down=10,
+                                       shape=LocationShape.Random, distribution=DistributionRule.Random)
+
+    raw_stats_cooldown_2 = run_experiment_batched(env_cooldown_2, TIMES)
+    raw_stats_cooldown_3 = run_experiment_batched(env_cooldown_3, TIMES)
+    raw_stats_cooldown_4 = run_experiment_batched(env_cooldown_4, TIMES)
+    raw_stats_cooldown_5 = run_experiment_batched(env_cooldown_5, TIMES)
+    raw_stats_cooldown_6 = run_experiment_batched(env_cooldown_6, TIMES)
+    raw_stats_cooldown_8 = run_experiment_batched(env_cooldown_8, TIMES)
+    raw_stats_cooldown_10 = run_experiment_batched(env_cooldown_10, TIMES)
 
     # for believers_percentage in raw_stats_cooldown_1:
     #     print(f"population believers percentage:{believers_percentage}")
@@ -181,11 +308,11 @@ def main_shapes():
                                        shape=LocationShape.Random,distribution=DistributionRule.Random)
 
 
-    raw_stats_frame = run_experiment_multiple_times(env_frame, TIMES)
-    raw_stats_square = run_experiment_multiple_times(env_square, TIMES)
-    raw_stats_lines = run_experiment_multiple_times(env_lines, TIMES)
-    raw_stats_david = run_experiment_multiple_times(env_david, TIMES)
-    raw_stats_random = run_experiment_multiple_times(env_random, TIMES)
+    raw_stats_frame = run_experiment_batched(env_frame, TIMES)
+    raw_stats_square = run_experiment_batched(env_square, TIMES)
+    raw_stats_lines = run_experiment_batched(env_lines, TIMES)
+    raw_stats_david = run_experiment_batched(env_david, TIMES)
+    raw_stats_random = run_experiment_batched(env_random, TIMES)
 
 
     avg_believers_frame = calc_average_per_turn(raw_stats_frame)
@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+import typing
+from typing import List
+
+import numpy as np
+
+DEFAULT_TURNS_PER_SECOND = 100
+DEFAULT_MAX_QUEUED_FRAMES = 2
+
+Frame = typing.NamedTuple("Frame", [("turn", int), ("colour_indices", np.ndarray), ("believers_percentage", float)])
+
+
+class SimulationWorker(threading.Thread):
+    """
+    Runs the turns of an EnvMap in a background thread and publishes a Frame after every turn.
+    The frames queue is bounded and the oldest frame is dropped when it is full, so a slow consumer never
+    slows the simulation down; the believers percentage of every turn is kept in believers_percentage.
+    Unless run_as_fast_as_possible is set, at most turns_per_second turns are run per second
+    """
+
+    def __init__(self, env_map, n_turns: int, colour_indices: typing.Callable, stop_when_quiescent: bool = True,
+                 recorder=None, turns_per_second: float = DEFAULT_TURNS_PER_SECOND,
+                 max_queued_frames: int = DEFAULT_MAX_QUEUED_FRAMES):
+        super().__init__(daemon=True)
+        self.env_map = env_map
+        self.n_turns = n_turns
+        # env_map -> colour index grid of a frame, called in the worker thread
+        self._colour_indices = colour_indices
+        self.stop_when_quiescent = stop_when_quiescent
+        self.recorder = recorder
+        self.turns_per_second = turns_per_second
+        self.run_as_fast_as_possible = False
+        self.believers_percentage: List[float] = []
+        self.frames = queue.Queue(maxsize=max_queued_frames)
+        self._condition = threading.Condition()
+        self._paused = False
+        self._n_steps = 0
+        self._frame_requested = False
+        self._stopped = False
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    @property
+    def finished(self) -> bool:
+        return not self.is_alive() and self.frames.empty()
+
+    def toggle_pause(self) -> None:
+        with self._condition:
+            self._paused = not self._paused
+            # steps left from the last pause don't carry over to the next one
+            self._n_steps = 0
+            self._condition.notify_all()
+
+    def step(self) -> None:
+        # runs a single turn while paused, does nothing while running
+        with self._condition:
+            if not self._paused:
+                return
+            self._n_steps += 1
+            self._condition.notify_all()
+
+    def toggle_run_as_fast_as_possible(self) -> None:
+        with self._condition:
+            self.run_as_fast_as_possible = not self.run_as_fast_as_possible
+            self._condition.notify_all()
+
+    def request_frame(self) -> None:
+        # publishes a frame of the current state (e.g. of a new view while paused), rendered in the worker
+        # thread between turns, so it never shows a half applied turn
+        with self._condition:
+            self._frame_requested = True
+            self._condition.notify_all()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def _wait_for_next_turn(self, next_turn_time: float) -> bool:
+        # blocks while paused (until a step) and until next_turn_time, returns False once stopped
+        with self._condition:
+            while not self._stopped:
+                if self._frame_requested:
+                    self._frame_requested = False
+                    self._publish(self._frame())
+                if self._paused:
+                    if self._n_steps > 0:
+                        self._n_steps -= 1
+                        return True
+                    self._condition.wait()
+                    continue
+                delay = next_turn_time - time.perf_counter()
+                if self.run_as_fast_as_possible or delay <= 0:
+                    return True
+                self._condition.wait(delay)
+            return False
+
+    def _publish(self, frame: Frame) -> None:
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _frame(self) -> Frame:
+        return Frame(
+            turn=self.env_map.turn,
+            colour_indices=self._colour_indices(self.env_map),
+            believers_percentage=self.env_map.calculate_percentage_of_believers(),
+        )
+
+    def get_newest_frame(self) -> Frame:
+        # the last published frame, the older ones are skipped. None if nothing was published since the last call
+        frame = None
+        while True:
+            try:
+                frame = self.frames.get_nowait()
+            except queue.Empty:
+                return frame
+
+    def run(self) -> None:
+        next_turn_time = time.perf_counter()
+        for i in range(self.n_turns):
+            if not self._wait_for_next_turn(next_turn_time):
+                return
+            next_turn_time = max(next_turn_time, time.perf_counter() - 1 / self.turns_per_second) \
+                + 1 / self.turns_per_second
+            self.env_map.spread_rumor()
+            if self.recorder is not None:
+                self.recorder.record(self.env_map)
+            frame = self._frame()
+            self.believers_percentage.append(frame.believers_percentage)
+            self._publish(frame)
+            # nothing will change anymore, keep the final percentage for the remaining turns
+            if self.stop_when_quiescent and self.env_map.is_quiescent():
+                self.believers_percentage.extend(
+                    [self.believers_percentage[-1]] * (self.n_turns - len(self.believers_percentage))
+                )
+                return
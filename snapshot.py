@@ -0,0 +1,69 @@
+import json
+import os
+import struct
+import tempfile
+from typing import Dict, Tuple
+
+import numpy as np
+
+# file layout: magic, header length (uint64 little endian), JSON header, then the raw arrays,
+# each one starting at an ALIGNMENT boundary so it can be memory mapped in place
+MAGIC = b"RUMOURS1"
+ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(path: str, header: Dict, arrays: Dict[str, np.ndarray]) -> None:
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    # the arrays' offsets are relative to the end of the header, so they don't depend on the header size
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+    header_bytes = json.dumps({"header": header, "arrays": layout}).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+    # written to a temporary file next to path and then moved onto it: a map loaded with mmap from path keeps
+    # mapping the old file, and a write that is interrupted leaves the previous snapshot in place
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(header_bytes)))
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def read_snapshot(path: str, mmap: bool = True) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    # with mmap the arrays are copy-on-write memory maps of the file: pages are read on first use,
+    # and changes stay private to the process, the file is never modified
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise Exception(f"{path} is not a snapshot file")
+        header_length, = struct.unpack("<Q", f.read(8))
+        content = json.loads(f.read(header_length).decode("utf-8"))
+        data_start = _align(len(MAGIC) + 8 + header_length)
+        arrays = {}
+        for name, layout in content["arrays"].items():
+            dtype = np.dtype(layout["dtype"])
+            shape = tuple(layout["shape"])
+            offset = data_start + layout["offset"]
+            if mmap and int(np.prod(shape)) > 0:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="c", offset=offset, shape=shape)
+            else:
+                f.seek(offset)
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return content["header"], arrays
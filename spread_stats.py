@@ -0,0 +1,58 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+from DoubtLevel import DoubtLevel
+from vectorized_engine import NEVER_HEARD
+
+# statistics of how fast and how far the rumour spread, computed from a first heard turn grid
+# (see EnvMap.first_heard_turn_grid) instead of a snapshot of the map per turn
+
+
+def first_spreader_location(first_heard_turn: np.ndarray) -> Tuple[int, int]:
+    first_spreaders = np.argwhere(first_heard_turn == 0)
+    if len(first_spreaders) == 0:
+        raise Exception("There is no first spreader, nobody heard the rumour at turn 0")
+    x, y = first_spreaders[0]
+    return int(x), int(y)
+
+
+def distances_from(shape: Tuple[int, int], origin: Tuple[int, int], wrap: bool = False) -> np.ndarray:
+    # euclidean distance of every square from origin, across the map's edges when it wraps
+    dx = np.abs(np.arange(shape[0]) - origin[0])
+    dy = np.abs(np.arange(shape[1]) - origin[1])
+    if wrap:
+        dx = np.minimum(dx, shape[0] - dx)
+        dy = np.minimum(dy, shape[1] - dy)
+    return np.hypot(dx[:, None], dy[None, :])
+
+
+def radius_by_turn(first_heard_turn: np.ndarray, origin: Tuple[int, int] = None, wrap: bool = False) -> np.ndarray:
+    # distance of the farthest person who heard the rumour from origin (the first spreader by default),
+    # at every turn from 0 to the last turn somebody first heard it
+    if origin is None:
+        origin = first_spreader_location(first_heard_turn)
+    heard = first_heard_turn != NEVER_HEARD
+    turns = first_heard_turn[heard]
+    farthest = np.zeros(turns.max() + 1)
+    np.maximum.at(farthest, turns, distances_from(first_heard_turn.shape, origin=origin, wrap=wrap)[heard])
+    return np.maximum.accumulate(farthest)
+
+
+def front_speed(radius: np.ndarray) -> float:
+    # squares per turn the spread front moved, least squares slope of the radius until it stopped growing
+    last_turn = int(np.argmax(radius))
+    if last_turn == 0:
+        return 0.0
+    slope, _ = np.polyfit(np.arange(last_turn + 1), radius[:last_turn + 1], 1)
+    return float(slope)
+
+
+def arrival_time_histograms(first_heard_turn: np.ndarray, doubt: np.ndarray) -> Dict[DoubtLevel, np.ndarray]:
+    # number of persons of every DoubtLevel who first heard the rumour at each turn
+    heard = first_heard_turn != NEVER_HEARD
+    n_turns = int(first_heard_turn[heard].max()) + 1 if heard.any() else 0
+    return {
+        doubt_level: np.bincount(first_heard_turn[heard & (doubt == doubt_level.value)], minlength=n_turns)
+        for doubt_level in DoubtLevel
+    }
@@ -0,0 +1,337 @@
+import copy
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from DoubtLevel import DoubtLevel
+from phase_stats import PhaseStats
+
+EMPTY_DOUBT_LEVEL = 0
+# first heard turn of the persons who never heard the rumour, and of the empty squares
+NEVER_HEARD = -1
+
+# bits of the per square flags array
+HEARD_RUMOUR_SOMETIME = np.uint8(1)
+HEARD_RUMOUR_LAST_TURN = np.uint8(2)
+IN_COOLDOWN = np.uint8(4)
+
+MAX_COOL_DOWN_L = np.iinfo(np.uint8).max
+
+# per square state arrays and per map running counters, stacked along a leading replica axis by VectorizedEngine.stack.
+# the optional int32 first_heard_turn grid is kept apart from the compact 3 bytes per square state
+GRID_ARRAYS = ("doubt", "flags", "countdown")
+STATE_ARRAYS = GRID_ARRAYS + (
+    "n_heard_rumour_sometime_per_doubt_level", "n_heard_rumour_last_turn", "n_in_cooldown",
+)
+
+
+class VectorizedEngine:
+    """
+    Keeps the simulation state as NumPy arrays and computes a whole turn with array operations.
+    Follows the same rules as PersonCell.should_believe_to_rumour and PersonCell.next_turn.
+    The state is either a single (n_rows, n_cols) map or R replicas stacked as (R, n_rows, n_cols),
+    stored compactly as an int8 doubt level, a uint8 cooldown countdown and uint8 bit flags per square.
+    """
+
+    def __init__(
+            self,
+            doubt_levels: np.ndarray,
+            cool_down_l: int,
+            neighbor_offsets: Iterable[Tuple[int, int]],
+            wrap: bool,
+            probability_to_believe: Dict[DoubtLevel, float],
+            min_doubt_level: int,
+            rng: np.random.Generator = None,
+            track_first_heard_turn: bool = False
+    ):
+        self._init_rules(
+            cool_down_l=cool_down_l,
+            neighbor_offsets=neighbor_offsets,
+            wrap=wrap,
+            probability_to_believe=probability_to_believe,
+            min_doubt_level=min_doubt_level,
+            rng=rng,
+        )
+        # doubt level value per square, EMPTY_DOUBT_LEVEL where there is no person
+        self.doubt = np.array(doubt_levels, dtype=np.int8)
+        self.flags = np.zeros(self.doubt.shape, dtype=np.uint8)
+        self.countdown = np.where(self.is_person, cool_down_l, 0).astype(np.uint8)
+        # the turn each person first heard the rumour at, opt-in as it takes 4 more bytes per square
+        self.first_heard_turn: np.ndarray = None
+        if track_first_heard_turn:
+            self.first_heard_turn = np.full(self.doubt.shape, NEVER_HEARD, dtype=np.int32)
+        self.turn = 0
+        # flat indices of the squares that first heard the rumour in the last turn (or were the first spreader)
+        self.newly_heard_rumour_sometime = np.zeros(0, dtype=np.int64)
+
+        # running counters, updated with the changes of every turn so the metrics need no scan
+        self.n_heard_rumour_sometime_per_doubt_level = np.zeros(len(DoubtLevel) + 1, dtype=np.int64)
+        self.n_heard_rumour_last_turn = np.zeros((), dtype=np.int64)
+        self.n_in_cooldown = np.zeros((), dtype=np.int64)
+
+    def _init_rules(
+            self,
+            cool_down_l: int,
+            neighbor_offsets: Iterable[Tuple[int, int]],
+            wrap: bool,
+            probability_to_believe: Dict[DoubtLevel, float],
+            min_doubt_level: int,
+            rng: np.random.Generator = None
+    ) -> None:
+        if cool_down_l < 0 or cool_down_l > MAX_COOL_DOWN_L:
+            raise Exception(
+                f"Invalid value of cool down, it should be between 0 to {MAX_COOL_DOWN_L}, not:{cool_down_l}"
+            )
+        self.cool_down_l = cool_down_l
+        self._neighbor_offsets = list(neighbor_offsets)
+        self._wrap = wrap
+        # one generator per replica, each replica draws for its own listeners only
+        self._rngs = [rng if rng is not None else np.random.default_rng()]
+
+        # lookup tables indexed by doubt level value
+        self._probability_to_believe = np.zeros(len(DoubtLevel) + 1)
+        self._boosted_probability_to_believe = np.zeros(len(DoubtLevel) + 1)
+        for doubt_level in DoubtLevel:
+            temporal_doubt_level = DoubtLevel(max(doubt_level.value - 1, min_doubt_level))
+            self._probability_to_believe[doubt_level.value] = probability_to_believe[doubt_level]
+            self._boosted_probability_to_believe[doubt_level.value] = probability_to_believe[temporal_doubt_level]
+
+    @classmethod
+    def from_state(
+            cls,
+            doubt: np.ndarray,
+            flags: np.ndarray,
+            countdown: np.ndarray,
+            first_heard_turn: np.ndarray,
+            turn: int,
+            counters: Dict = None,
+            **rules
+    ) -> "VectorizedEngine":
+        # an engine working directly on the given state arrays (e.g. memory maps of a snapshot), nothing grid
+        # sized is allocated. rules are the __init__ arguments but doubt_levels, see load_state for counters
+        engine = cls.__new__(cls)
+        engine._init_rules(**rules)
+        engine.load_state(
+            doubt=doubt, flags=flags, countdown=countdown, first_heard_turn=first_heard_turn, turn=turn,
+            counters=counters,
+        )
+        return engine
+
+    @classmethod
+    def stack(cls, engines: List["VectorizedEngine"]) -> "VectorizedEngine":
+        # one engine advancing all the given single map engines together
+        first = engines[0]
+        for engine in engines:
+            if engine.doubt.shape != first.doubt.shape or engine.doubt.ndim != 2:
+                raise Exception(f"Only single maps of the same size can be stacked, got:{engine.doubt.shape}")
+            if (engine.cool_down_l != first.cool_down_l or engine._wrap != first._wrap
+                    or engine._neighbor_offsets != first._neighbor_offsets):
+                raise Exception("Only engines with the same cooldown and policy can be stacked")
+            if (engine.first_heard_turn is None) != (first.first_heard_turn is None):
+                raise Exception("Only engines that all track or all don't track the first heard turn can be stacked")
+        stacked = copy.copy(first)
+        for name in STATE_ARRAYS:
+            setattr(stacked, name, np.stack([getattr(engine, name) for engine in engines]))
+        if first.first_heard_turn is not None:
+            stacked.first_heard_turn = np.stack([engine.first_heard_turn for engine in engines])
+        stacked._rngs = [engine._rngs[0] for engine in engines]
+        return stacked
+
+    @property
+    def n_replicas(self) -> int:
+        return self.doubt.shape[0] if self.doubt.ndim == 3 else 1
+
+    @property
+    def is_person(self) -> np.ndarray:
+        return self.doubt != EMPTY_DOUBT_LEVEL
+
+    @property
+    def heard_sometime(self) -> np.ndarray:
+        return (self.flags & HEARD_RUMOUR_SOMETIME) != 0
+
+    @property
+    def heard_last_turn(self) -> np.ndarray:
+        return (self.flags & HEARD_RUMOUR_LAST_TURN) != 0
+
+    @property
+    def in_cooldown(self) -> np.ndarray:
+        return (self.flags & IN_COOLDOWN) != 0
+
+    def nbytes_per_cell(self) -> float:
+        # memory the compact persistent state takes per square (the temporaries of a turn are not included),
+        # see EnvMap.nbytes_per_cell for everything a map keeps
+        return sum(getattr(self, name).nbytes for name in GRID_ARRAYS) / self.doubt.size
+
+    def first_heard_turn_nbytes_per_cell(self) -> float:
+        # memory the optional first heard turn grid takes per square, on top of nbytes_per_cell
+        return self.first_heard_turn.nbytes / self.doubt.size if self.first_heard_turn is not None else 0.0
+
+    def get_flag(self, position: Tuple[int, int], flag: np.uint8) -> bool:
+        return bool(self.flags[position] & flag)
+
+    def set_flag(self, position: Tuple[int, int], flag: np.uint8, value: bool) -> None:
+        # single square update (used by the cell views), keeps the running counters in sync
+        if self.get_flag(position, flag) == value:
+            return
+        change = 1 if value else -1
+        if flag == HEARD_RUMOUR_SOMETIME:
+            self.n_heard_rumour_sometime_per_doubt_level[self.doubt[position]] += change
+        elif flag == HEARD_RUMOUR_LAST_TURN:
+            self.n_heard_rumour_last_turn += change
+        elif flag == IN_COOLDOWN:
+            self.n_in_cooldown += change
+        if value:
+            self.flags[position] |= flag
+        else:
+            self.flags[position] &= ~flag
+
+    def load_state(
+            self,
+            doubt: np.ndarray,
+            flags: np.ndarray,
+            countdown: np.ndarray,
+            first_heard_turn: np.ndarray,
+            turn: int,
+            counters: Dict = None
+    ) -> None:
+        # replaces the single map state (e.g. with memory maps of a snapshot). counters are the running counters
+        # of the state as saved by EnvMap.save ({name: value} of the n_* attributes), without them they are
+        # recounted, which reads the whole flags grid. first_heard_turn is None when it is not tracked
+        self.doubt = doubt
+        self.flags = flags
+        self.countdown = countdown
+        self.first_heard_turn = first_heard_turn
+        self.turn = turn
+        self.newly_heard_rumour_sometime = np.zeros(0, dtype=np.int64)
+        if counters is not None:
+            self.n_heard_rumour_sometime_per_doubt_level = np.array(
+                counters["n_heard_rumour_sometime_per_doubt_level"], dtype=np.int64
+            )
+            self.n_heard_rumour_last_turn = np.array(counters["n_heard_rumour_last_turn"], dtype=np.int64)
+            self.n_in_cooldown = np.array(counters["n_in_cooldown"], dtype=np.int64)
+            return
+        self.n_heard_rumour_sometime_per_doubt_level = np.bincount(
+            doubt[self.heard_sometime], minlength=len(DoubtLevel) + 1
+        ).astype(np.int64)
+        self.n_heard_rumour_last_turn = np.array(np.count_nonzero(self.heard_last_turn), dtype=np.int64)
+        self.n_in_cooldown = np.array(np.count_nonzero(self.in_cooldown), dtype=np.int64)
+
+    def set_first_spreader(self, x: int, y: int) -> None:
+        self.set_flag((x, y), HEARD_RUMOUR_SOMETIME, True)
+        self.set_flag((x, y), HEARD_RUMOUR_LAST_TURN, True)
+        self.countdown[x, y] = 0
+        if self.first_heard_turn is not None:
+            self.first_heard_turn[x, y] = self.turn
+        self.newly_heard_rumour_sometime = np.array([x * self.doubt.shape[-1] + y], dtype=np.int64)
+
+    def count_neighbor_hits(self, spreaders: np.ndarray) -> np.ndarray:
+        # each spreader tells every neighbor, so the hits are a sum of the shifted spreaders mask
+        n_heard = np.zeros(spreaders.shape, dtype=np.int8)
+        n_rows, n_cols = spreaders.shape[-2:]
+        for dx, dy in self._neighbor_offsets:
+            if self._wrap:
+                n_heard += np.roll(spreaders, shift=(dx, dy), axis=(-2, -1))
+                continue
+            n_heard[..., max(dx, 0):n_rows + min(dx, 0), max(dy, 0):n_cols + min(dy, 0)] += \
+                spreaders[..., max(-dx, 0):n_rows - max(dx, 0), max(-dy, 0):n_cols - max(dy, 0)]
+        n_heard[self.doubt == EMPTY_DOUBT_LEVEL] = 0
+        return n_heard
+
+    def spread_rumor(self, phase_stats: PhaseStats = None) -> None:
+        # phase_stats, if given, records the wall time of every phase and the counts of the turn
+        # (summed over the replicas of a stacked engine)
+        self.turn += 1
+        if phase_stats is not None:
+            phase_stats.start_turn()
+        # calc who can spread rumour in this episode
+        spreaders = self.heard_last_turn & (self.countdown == 0)
+        if phase_stats is not None:
+            phase_stats.end_phase("find_spreaders")
+
+        # Count number of times each cell got rumour
+        n_heard = self.count_neighbor_hits(spreaders)
+        if phase_stats is not None:
+            phase_stats.end_phase("count_hits")
+
+        # update the rumour spreaders in this episode: RST cool time, cooldown to False, heard rumour to False
+        n_spreaders = np.count_nonzero(spreaders, axis=(-2, -1))
+        self.n_heard_rumour_last_turn -= n_spreaders
+        np.bitwise_and(self.flags, ~HEARD_RUMOUR_LAST_TURN, out=self.flags, where=spreaders)
+        np.bitwise_or(self.flags, IN_COOLDOWN, out=self.flags, where=spreaders)
+        self.countdown[spreaders] = self.cool_down_l
+        if phase_stats is not None:
+            phase_stats.end_phase("reset_spreaders")
+
+        # Calculate who believes the rumour, one batched draw for all the listeners
+        listeners = np.flatnonzero((n_heard > 0) & ~self.in_cooldown)
+        listeners_doubt = self.doubt.ravel()[listeners]
+        prob_to_believe = np.where(
+            n_heard.ravel()[listeners] >= 2,
+            self._boosted_probability_to_believe[listeners_doubt],
+            self._probability_to_believe[listeners_doubt],
+        )
+        believers = listeners[self._random(listeners) < prob_to_believe]
+
+        # update the state of cells that were told the rumour in this episode
+        self._count_believers(believers)
+        if self.first_heard_turn is not None:
+            first_heard_turn = self.first_heard_turn.ravel()
+            first_heard_turn[believers[first_heard_turn[believers] == NEVER_HEARD]] = self.turn
+        self.flags.ravel()[believers] |= HEARD_RUMOUR_LAST_TURN | HEARD_RUMOUR_SOMETIME
+        self.countdown.ravel()[believers] = 1
+        if phase_stats is not None:
+            phase_stats.end_phase("draw_beliefs")
+
+        # Prepare for next turn (for example: dec cooldown values)
+        self.next_turn()
+        if phase_stats is not None:
+            phase_stats.end_phase("next_turn")
+            phase_stats.end_turn(
+                n_spreaders=np.sum(n_spreaders),
+                n_hits=n_heard.sum(),
+                n_listeners=len(listeners),
+                n_believers=len(believers),
+            )
+
+    def _random(self, flat_indices: np.ndarray) -> np.ndarray:
+        # a uniform draw per (sorted) flat index, from the generator of the index's replica, so a replica
+        # draws the same numbers stacked or alone
+        counts = np.bincount(flat_indices // (self.doubt.shape[-2] * self.doubt.shape[-1]), minlength=len(self._rngs))
+        return np.concatenate([rng.random(count) for rng, count in zip(self._rngs, counts.tolist())])
+
+    def next_turn(self) -> None:
+        ticking = ((self.flags & (HEARD_RUMOUR_LAST_TURN | IN_COOLDOWN)) != 0) & (self.countdown > 0)
+        np.subtract(self.countdown, 1, out=self.countdown, where=ticking)
+        # Cooldown finished
+        np.bitwise_and(self.flags, ~IN_COOLDOWN, out=self.flags, where=self.countdown == 0)
+        self.n_in_cooldown = np.count_nonzero(self.flags & IN_COOLDOWN, axis=(-2, -1))
+
+    def _count_believers(self, believers: np.ndarray) -> None:
+        # replica of every believer, 0 for a single map
+        replicas = believers // (self.doubt.shape[-2] * self.doubt.shape[-1])
+        believers_flags = self.flags.ravel()[believers]
+        n_heard_rumour_last_turn = self.n_heard_rumour_last_turn.reshape(-1)
+        new_last_turn = (believers_flags & HEARD_RUMOUR_LAST_TURN) == 0
+        np.add.at(n_heard_rumour_last_turn, replicas[new_last_turn], 1)
+        n_heard_rumour_sometime_per_doubt_level = self.n_heard_rumour_sometime_per_doubt_level.reshape(
+            -1, len(DoubtLevel) + 1
+        )
+        first_time = (believers_flags & HEARD_RUMOUR_SOMETIME) == 0
+        self.newly_heard_rumour_sometime = believers[first_time]
+        np.add.at(
+            n_heard_rumour_sometime_per_doubt_level,
+            (replicas[first_time], self.doubt.ravel()[believers[first_time]]),
+            1,
+        )
+
+    def is_quiescent(self) -> bool:
+        return not (self.flags & (HEARD_RUMOUR_LAST_TURN | IN_COOLDOWN)).any()
+
+    def quiescent_per_replica(self) -> np.ndarray:
+        return ~(self.flags & (HEARD_RUMOUR_LAST_TURN | IN_COOLDOWN)).any(axis=(-2, -1))
+
+    def count_heard_rumour_sometime(self) -> int:
+        return int(self.n_heard_rumour_sometime_per_doubt_level.sum())
+
+    def count_heard_rumour_sometime_per_replica(self) -> np.ndarray:
+        return self.n_heard_rumour_sometime_per_doubt_level.sum(axis=-1)
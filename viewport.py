@@ -0,0 +1,172 @@
+import math
+import typing
+from typing import Tuple
+
+import numpy as np
+
+from frame_colours import MAX_DENSITY_INDEX, GRID_LINE_INDEX
+
+MAX_PIXELS_PER_CELL = 64
+# grid lines only when the squares are big enough to see their colour inside them
+MIN_TILE_SIZE_FOR_GRID_LINES = 4
+
+# the shown part of the map: its top left square and the zoom, either pixels_per_cell screen pixels per square
+# (zoomed in) or a pixel per block of cells_per_pixel x cells_per_pixel squares (zoomed out), one of them is 1
+View = typing.NamedTuple(
+    "View", [("origin_row", int), ("origin_col", int), ("pixels_per_cell", int), ("cells_per_pixel", int)]
+)
+
+
+def block_counts_dtype(block_size: int) -> np.dtype:
+    # the smallest dtype that holds the count of a block_size x block_size block
+    return np.dtype(np.uint16) if block_size ** 2 <= np.iinfo(np.uint16).max else np.dtype(np.int32)
+
+
+def block_counts(mask: np.ndarray, block_size: int) -> np.ndarray:
+    # number of True squares in every block_size x block_size block, the last blocks may be smaller
+    row_starts = np.arange(0, mask.shape[0], block_size)
+    col_starts = np.arange(0, mask.shape[1], block_size)
+    # along the (contiguous) rows first, a block row has at most block_size squares so uint16 doesn't overflow
+    return np.add.reduceat(
+        np.add.reduceat(mask.view(np.uint8), col_starts, axis=1, dtype=np.uint16), row_starts, axis=0,
+        dtype=block_counts_dtype(block_size)
+    )
+
+
+def block_sizes(start: int, stop: int, block_size: int, size: int) -> np.ndarray:
+    # number of squares of the blocks start:stop of a size squares long axis, the last block may be smaller
+    block_starts = np.arange(start, stop) * block_size
+    return np.minimum(block_starts + block_size, size) - block_starts
+
+
+class Viewport:
+    """
+    The part of an n_rows x n_cols map shown on a width x height pixels screen area, with zoom and pan.
+    Zoomed out every pixel shows the rumour density of a block of squares (see frame_colours.DENSITY_PALETTE).
+    Zoomed in colour_indices reads only the visible squares. Zoomed out it keeps the heard counts of all the
+    map's blocks, updated with the squares that first heard the rumour every turn, and reads only the visible
+    blocks. So a frame costs the screen size plus the turn's new hearers, only a change of the zoom level (or a
+    jump of more than a turn) recounts the whole map
+    """
+
+    def __init__(self, n_rows: int, n_cols: int, width: int, height: int, pixels_per_cell: int = 1):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.width = width
+        self.height = height
+        # zooming out further than showing the whole map is not needed
+        self.max_cells_per_pixel = max(1, math.ceil(max(n_rows / height, n_cols / width)))
+        if n_rows * pixels_per_cell <= height and n_cols * pixels_per_cell <= width:
+            self.view = View(origin_row=0, origin_col=0, pixels_per_cell=pixels_per_cell, cells_per_pixel=1)
+        else:
+            self.view = View(origin_row=0, origin_col=0, pixels_per_cell=1, cells_per_pixel=self.max_cells_per_pixel)
+        # the heard counts of the map's cells_per_pixel x cells_per_pixel blocks of the last zoomed out frame,
+        # the map, block size and turn they are of. only colour_indices uses them (in the thread it is called in)
+        self._block_counts: np.ndarray = None
+        self._block_counts_of = (None, None, None)
+
+    @staticmethod
+    def _visible_size(pixels: int, view: View) -> int:
+        # number of squares shown along pixels screen pixels
+        return math.ceil(pixels / view.pixels_per_cell) * view.cells_per_pixel
+
+    def visible_cells(self, view: View = None) -> Tuple[slice, slice]:
+        view = self.view if view is None else view
+        n_rows = self._visible_size(self.height, view)
+        n_cols = self._visible_size(self.width, view)
+        return (
+            slice(view.origin_row, min(view.origin_row + n_rows, self.n_rows)),
+            slice(view.origin_col, min(view.origin_col + n_cols, self.n_cols)),
+        )
+
+    def _set_view(self, origin_row: float, origin_col: float, pixels_per_cell: int, cells_per_pixel: int) -> None:
+        view = View(0, 0, pixels_per_cell, cells_per_pixel)
+        max_origin_row = max(0, self.n_rows - self._visible_size(self.height, view))
+        max_origin_col = max(0, self.n_cols - self._visible_size(self.width, view))
+        # zoomed out the origin is the first square of a block, so the pixels show the map's own blocks
+        origin_row = int(min(max(round(origin_row), 0), max_origin_row)) // cells_per_pixel * cells_per_pixel
+        origin_col = int(min(max(round(origin_col), 0), max_origin_col)) // cells_per_pixel * cells_per_pixel
+        # a single assignment, so a render in another thread sees either the old or the new view
+        self.view = view._replace(origin_row=origin_row, origin_col=origin_col)
+
+    def screen_to_cell(self, x: int, y: int) -> Tuple[float, float]:
+        view = self.view
+        return (
+            view.origin_row + y * view.cells_per_pixel / view.pixels_per_cell,
+            view.origin_col + x * view.cells_per_pixel / view.pixels_per_cell,
+        )
+
+    def pan(self, dx: int, dy: int) -> None:
+        # moves the map by dx, dy screen pixels (so the view moves the other way)
+        view = self.view
+        self._set_view(
+            origin_row=view.origin_row - dy * view.cells_per_pixel / view.pixels_per_cell,
+            origin_col=view.origin_col - dx * view.cells_per_pixel / view.pixels_per_cell,
+            pixels_per_cell=view.pixels_per_cell,
+            cells_per_pixel=view.cells_per_pixel,
+        )
+
+    def zoom(self, zoom_in: bool, x: int = None, y: int = None) -> None:
+        # zooms in / out by a factor of 2, the square under the screen pixel x, y (default: the center) stays in place
+        x = self.width // 2 if x is None else x
+        y = self.height // 2 if y is None else y
+        view = self.view
+        pixels_per_cell, cells_per_pixel = view.pixels_per_cell, view.cells_per_pixel
+        if zoom_in:
+            if cells_per_pixel > 1:
+                cells_per_pixel //= 2
+            else:
+                pixels_per_cell = min(pixels_per_cell * 2, MAX_PIXELS_PER_CELL)
+        else:
+            if pixels_per_cell > 1:
+                pixels_per_cell //= 2
+            else:
+                cells_per_pixel = min(cells_per_pixel * 2, self.max_cells_per_pixel)
+        row, col = self.screen_to_cell(x, y)
+        self._set_view(
+            origin_row=row - y * cells_per_pixel / pixels_per_cell,
+            origin_col=col - x * cells_per_pixel / pixels_per_cell,
+            pixels_per_cell=pixels_per_cell,
+            cells_per_pixel=cells_per_pixel,
+        )
+
+    def _update_block_counts(self, env_map, block_size: int) -> None:
+        # brings the block counts to the map's turn: the next turn adds its new hearers, anything else recounts
+        env_map_of, block_size_of, turn_of = self._block_counts_of
+        if env_map_of is env_map and block_size_of == block_size and turn_of == env_map.turn - 1:
+            rows, cols = np.divmod(env_map.newly_heard_rumour_sometime_indices(), self.n_cols)
+            np.add.at(self._block_counts, (rows // block_size, cols // block_size), 1)
+        elif not (env_map_of is env_map and block_size_of == block_size and turn_of == env_map.turn):
+            self._block_counts = block_counts(env_map.heard_rumour_sometime_grid(), block_size)
+        self._block_counts_of = (env_map, block_size, env_map.turn)
+
+    def _block_density(self, env_map, rows: slice, cols: slice, block_size: int) -> np.ndarray:
+        # share of the heard squares in the blocks of the visible (block aligned) rows and cols
+        self._update_block_counts(env_map, block_size)
+        block_rows = slice(rows.start // block_size, -(-rows.stop // block_size))
+        block_cols = slice(cols.start // block_size, -(-cols.stop // block_size))
+        return self._block_counts[block_rows, block_cols] / np.outer(
+            block_sizes(block_rows.start, block_rows.stop, block_size, self.n_rows),
+            block_sizes(block_cols.start, block_cols.stop, block_size, self.n_cols),
+        )
+
+    def colour_indices(self, env_map) -> np.ndarray:
+        # uint8 (height, width) screen image of the view, indices into frame_colours.DENSITY_PALETTE
+        view = self.view
+        rows, cols = self.visible_cells(view)
+        if view.cells_per_pixel > 1:
+            density = self._block_density(env_map, rows, cols, view.cells_per_pixel)
+            image = np.rint(density * MAX_DENSITY_INDEX).astype(np.uint8)
+        else:
+            heard = env_map.heard_rumour_sometime_grid(rows=rows, cols=cols)
+            image = heard.astype(np.uint8) * np.uint8(MAX_DENSITY_INDEX)
+            image = np.repeat(np.repeat(image, view.pixels_per_cell, axis=0), view.pixels_per_cell, axis=1)
+            if view.pixels_per_cell >= MIN_TILE_SIZE_FOR_GRID_LINES:
+                # a 1 pixel gray outline around every square (like pygame.draw.rect(..., 1) per tile)
+                for edge in (0, view.pixels_per_cell - 1):
+                    image[edge::view.pixels_per_cell, :] = GRID_LINE_INDEX
+                    image[:, edge::view.pixels_per_cell] = GRID_LINE_INDEX
+        screen = np.zeros((self.height, self.width), dtype=np.uint8)
+        height, width = min(image.shape[0], self.height), min(image.shape[1], self.width)
+        screen[:height, :width] = image[:height, :width]
+        return screen